@@ -0,0 +1,306 @@
+"""
+Local stand-in for the Rossum API endpoints used by AsyncRequestClient.
+
+    python -m benchmarks.mock_server --port 8080 --annotations 5000 --latency 0.05
+
+Serves search (with pagination), annotation content, pages, emails, users,
+queues and groups under /v1. Every response is delayed by `latency` seconds
+(+- jitter) and a `throttle` share of requests is answered with 429 and a
+Retry-After header. GET /_stats returns request counts per endpoint.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter
+
+from aiohttp import web
+
+PAGE_SIZE = 100
+GROUPS = ["admin", "approver", "annotator", "viewer"]
+
+
+def _content(datapoints: int, padding: int) -> list:
+    """A content tree with one section of `datapoints` fields."""
+    children = [
+        {
+            "id": 1000 + i,
+            "url": f"https://mock/api/v1/annotations/0/content/{1000 + i}",
+            "category": "datapoint",
+            "schema_id": f"field_{i % 20}",
+            "content": {
+                "value": f"value {i} " + "x" * padding,
+                "page": 1,
+                "position": [100 + i, 200 + i, 300 + i, 220 + i],
+            },
+        }
+        for i in range(datapoints)
+    ]
+    return [
+        {
+            "id": 1,
+            "url": "https://mock/api/v1/annotations/0/content/1",
+            "category": "section",
+            "schema_id": "basic_info_section",
+            "children": children,
+        }
+    ]
+
+
+class MockRossum:
+    """
+    :param annotations: number of annotations the search matches
+    :param latency: seconds added to every response
+    :param jitter: latency varies uniformly by +- this share of it
+    :param datapoints: datapoints per annotation content (payload size)
+    :param padding: extra characters per datapoint value (payload size)
+    :param pages: pages per annotation
+    :param annotations_per_email: annotations sharing one related email
+    :param users: existing users
+    :param queues: existing queues
+    :param throttle: share of requests answered with 429
+    :param retry_after: Retry-After seconds sent with a 429
+    """
+
+    def __init__(
+        self,
+        annotations: int = 1000,
+        latency: float = 0.02,
+        jitter: float = 0.2,
+        datapoints: int = 50,
+        padding: int = 0,
+        pages: int = 2,
+        annotations_per_email: int = 5,
+        users: int = 200,
+        queues: int = 20,
+        throttle: float = 0.0,
+        retry_after: float = 0.1,
+    ) -> None:
+        self.annotations = annotations
+        self.latency = latency
+        self.jitter = jitter
+        self.pages = pages
+        self.annotations_per_email = annotations_per_email
+        self.users = users
+        self.queues = queues
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.requests = Counter()
+        self.throttled = Counter()
+        # Same content for every annotation, encoded once
+        self._content_body = json.dumps({"content": _content(datapoints, padding)})
+        self._created_users = []
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_post("/_stats/reset", self.reset)
+        app.router.add_post("/v1/annotations/search", self.search)
+        app.router.add_get("/v1/annotations/{id}/content", self.content)
+        app.router.add_get("/v1/pages", self.pages_listing)
+        app.router.add_get("/v1/emails/{id}", self.email)
+        app.router.add_get("/v1/users", self.list_users)
+        app.router.add_post("/v1/users", self.create_user)
+        app.router.add_post("/v1/auth/password/reset", self.reset_password)
+        app.router.add_get("/v1/queues", self.list_queues)
+        app.router.add_get("/v1/groups", self.list_groups)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        if request.path.startswith("/_stats"):
+            return await handler(request)
+        resource = request.match_info.route.resource
+        endpoint = resource.canonical if resource is not None else request.path
+        self.requests[endpoint] += 1
+        if self.latency:
+            spread = self.latency * self.jitter
+            await asyncio.sleep(self.latency + random.uniform(-spread, spread))
+        if self.throttle and random.random() < self.throttle:
+            self.throttled[endpoint] += 1
+            return web.json_response(
+                {"detail": "Request was throttled."},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        return await handler(request)
+
+    def _url(self, request, path: str) -> str:
+        return f"{request.scheme}://{request.host}/v1{path}"
+
+    def _paginate(self, request, items: list, make_result) -> web.Response:
+        page = int(request.query.get("page", 1))
+        page_size = int(request.query.get("page_size", PAGE_SIZE))
+        total_pages = max(1, -(-len(items) // page_size))
+        next_url = None
+        if page < total_pages:
+            next_path = request.rel_url.update_query(page=page + 1)
+            next_url = f"{request.scheme}://{request.host}{next_path}"
+        start = (page - 1) * page_size
+        return web.json_response(
+            {
+                "pagination": {
+                    "total": len(items),
+                    "total_pages": total_pages,
+                    "next": next_url,
+                    "previous": None,
+                },
+                "results": [
+                    make_result(item) for item in items[start : start + page_size]
+                ],
+            }
+        )
+
+    def _annotation(self, request, annotation_id: int) -> dict:
+        email_id = annotation_id // self.annotations_per_email
+        return {
+            "id": annotation_id,
+            "url": self._url(request, f"/annotations/{annotation_id}"),
+            "queue": self._url(request, f"/queues/{annotation_id % self.queues}"),
+            "schema": self._url(request, "/schemas/1"),
+            "status": "exported",
+            "created_at": "2024-01-01T00:00:00.000000Z",
+            "modified_at": "2024-01-02T00:00:00.000000Z",
+            "related_emails": [self._url(request, f"/emails/{email_id}")],
+            "content": self._url(request, f"/annotations/{annotation_id}/content"),
+        }
+
+    async def search(self, request):
+        return self._paginate(
+            request,
+            list(range(1, self.annotations + 1)),
+            lambda annotation_id: self._annotation(request, annotation_id),
+        )
+
+    async def content(self, request):
+        return web.Response(text=self._content_body, content_type="application/json")
+
+    async def pages_listing(self, request):
+        annotation_ids = [
+            int(annotation_id)
+            for annotation_id in request.query.get("annotation", "").split(",")
+            if annotation_id
+        ]
+        pages = [
+            (annotation_id, number)
+            for annotation_id in annotation_ids
+            for number in range(1, self.pages + 1)
+        ]
+        return self._paginate(
+            request,
+            pages,
+            lambda page: {
+                "id": page[0] * 100 + page[1],
+                "url": self._url(request, f"/pages/{page[0] * 100 + page[1]}"),
+                "annotation": self._url(request, f"/annotations/{page[0]}"),
+                "number": page[1],
+                "width": 1240,
+                "height": 1754,
+            },
+        )
+
+    async def email(self, request):
+        email_id = int(request.match_info["id"])
+        return web.json_response(
+            {
+                "id": email_id,
+                "url": self._url(request, f"/emails/{email_id}"),
+                "subject": f"Invoice {email_id}",
+                "from": {"email": "supplier@example.com", "name": "Supplier"},
+                "to": [{"email": "inbox@example.com", "name": "Inbox"}],
+                "body_text_plain": "Please find the invoice attached. " * 20,
+            }
+        )
+
+    async def list_users(self, request):
+        users = list(range(1, self.users + 1))
+        return self._paginate(
+            request,
+            users,
+            lambda user_id: {
+                "id": user_id,
+                "url": self._url(request, f"/users/{user_id}"),
+                "username": f"user{user_id}@example.com",
+                "first_name": "User",
+                "last_name": str(user_id),
+                "groups": [self._url(request, "/groups/3")],
+                "queues": [],
+                "deleted": False,
+            },
+        )
+
+    async def create_user(self, request):
+        user = await request.json()
+        user["id"] = self.users + len(self._created_users) + 1
+        self._created_users.append(user)
+        return web.json_response(user, status=201)
+
+    async def reset_password(self, request):
+        await request.json()
+        return web.json_response({"detail": "Password reset e-mail has been sent."})
+
+    async def list_queues(self, request):
+        return self._paginate(
+            request,
+            list(range(self.queues)),
+            lambda queue_id: {
+                "id": queue_id,
+                "url": self._url(request, f"/queues/{queue_id}"),
+                "name": f"Queue {queue_id}",
+            },
+        )
+
+    async def list_groups(self, request):
+        return self._paginate(
+            request,
+            list(enumerate(GROUPS, start=1)),
+            lambda group: {
+                "id": group[0],
+                "url": self._url(request, f"/groups/{group[0]}"),
+                "name": group[1],
+            },
+        )
+
+    async def stats(self, request):
+        return web.json_response(
+            {"requests": dict(self.requests), "throttled": dict(self.throttled)}
+        )
+
+    async def reset(self, request):
+        self.requests.clear()
+        self.throttled.clear()
+        self._created_users.clear()
+        return web.json_response({})
+
+
+def serve(port: int, options: dict = None) -> None:
+    """Run the mock server until the process is stopped."""
+    mock = MockRossum(**(options or {}))
+    web.run_app(mock.app(), host="127.0.0.1", port=port, print=None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock Rossum API server")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--annotations", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--datapoints", type=int, default=50)
+    parser.add_argument("--padding", type=int, default=0)
+    parser.add_argument("--throttle", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    print(f"Mock Rossum API on http://127.0.0.1:{args.port}")
+    serve(
+        args.port,
+        {
+            "annotations": args.annotations,
+            "latency": args.latency,
+            "datapoints": args.datapoints,
+            "padding": args.padding,
+            "throttle": args.throttle,
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
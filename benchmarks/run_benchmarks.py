@@ -0,0 +1,274 @@
+"""
+Throughput benchmarks of the fetch functions against the local mock API.
+
+    python -m benchmarks.run_benchmarks --annotations 2000 --latency 0.05
+    python -m benchmarks.run_benchmarks --scenarios content pages --throttle 0.02
+
+The mock server runs in its own process and every scenario runs in a fresh
+process, so peak RSS is the scenario's own. Per scenario it reports the
+requests the server saw (retries included), requests/s, client side
+p50/p99 latency per request and peak RSS.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import traceback
+from unittest import mock
+
+import aiohttp
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.mock_server import serve
+from rs_classes.async_request_client import AsyncRequestClient
+from rs_functions.fetch_annotation_content import get_annotation_content
+from rs_functions.fetch_annotations_list import search_with_query
+from rs_functions.fetch_emails import get_email_content
+from rs_functions.fetch_pages_data import get_annotations_page
+
+QUERY = {"query": {"status": {"$in": ["exported"]}}}
+
+
+class TimedClient(AsyncRequestClient):
+    """Client recording how long every request (with its retries) took."""
+
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+        TimedClient.instances.append(self)
+
+    async def _fetch(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super()._fetch(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+async def _search_all(client, options):
+    return await search_with_query(client, QUERY, allPages=True)
+
+
+async def _run_search(client, collection, options):
+    await search_with_query(client, QUERY, allPages=True)
+
+
+async def _run_content(client, collection, options):
+    await get_annotation_content(client, collection, concurrency=options["concurrency"])
+
+
+async def _run_pages(client, collection, options):
+    await get_annotations_page(client, collection, concurrency=options["concurrency"])
+
+
+async def _run_pages_batched(client, collection, options):
+    await get_annotations_page(
+        client, collection, concurrency=options["concurrency"], batch_size=100
+    )
+
+
+async def _run_emails(client, collection, options):
+    await get_email_content(client, collection, concurrency=options["concurrency"])
+
+
+# name: (setup, run), only run is measured
+SCENARIOS = {
+    "search": (None, _run_search),
+    "content": (_search_all, _run_content),
+    "pages": (_search_all, _run_pages),
+    "pages_batched": (_search_all, _run_pages_batched),
+    "emails": (_search_all, _run_emails),
+    # users_load.main builds its own client, see _run_users_load
+    "users_load": (None, None),
+}
+
+
+def _write_users_template(path: str, users: int) -> None:
+    """users_load template; the first row is a description and is skipped."""
+    rows = [
+        {
+            "auth_type": "auth type",
+            "email": "email",
+            "first_name": "first name",
+            "last_name": "last name",
+            "oidc_id": "oidc id",
+            "role": "role",
+            "queue_ids": "queue ids",
+            "can_approve": "can approve",
+        }
+    ]
+    for i in range(users):
+        # Every other user already exists on the mock server
+        rows.append(
+            {
+                "auth_type": "password" if i % 4 == 0 else "sso",
+                "email": f"user{i + 1}@example.com" if i % 2 else f"new{i}@example.com",
+                "first_name": "Bench",
+                "last_name": str(i),
+                "oidc_id": "",
+                "role": "annotator",
+                "queue_ids": "1\n2",
+                "can_approve": "yes" if i % 3 == 0 else "no",
+            }
+        )
+    pd.DataFrame(rows).to_excel(path, sheet_name="Users", index=False)
+
+
+async def _server_stats(base_url: str, reset: bool = False) -> dict:
+    async with aiohttp.ClientSession() as session:
+        if reset:
+            async with session.post(f"{base_url}/_stats/reset") as response:
+                return await response.json()
+        async with session.get(f"{base_url}/_stats") as response:
+            return await response.json()
+
+
+async def _run_users_load(base_url: str, options: dict) -> float:
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "users.xlsx")
+        _write_users_template(path, options["users"])
+        # users_load asks for its settings when imported
+        answers = iter(["bench-token", base_url, "1", path, "Users"])
+        with mock.patch("builtins.input", lambda prompt="": next(answers)):
+            import users_load
+
+        with mock.patch.object(users_load.rs, "AsyncRequestClient", TimedClient):
+            await _server_stats(base_url, reset=True)
+            start = time.perf_counter()
+            await users_load.main()
+            return time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+async def _run(name: str, base_url: str, options: dict) -> float:
+    if name == "users_load":
+        return await _run_users_load(base_url, options)
+
+    setup, run = SCENARIOS[name]
+    async with TimedClient(token="bench-token", domain=base_url) as client:
+        collection = await setup(client, options) if setup else None
+        client.latencies.clear()
+        await _server_stats(base_url, reset=True)
+        start = time.perf_counter()
+        await run(client, collection, options)
+        return time.perf_counter() - start
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_scenario(name: str, base_url: str, options: dict) -> dict:
+    """Run one scenario, meant to be called in a fresh process."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            seconds = asyncio.run(_run(name, base_url, options))
+            stats = asyncio.run(_server_stats(base_url))
+        except Exception:
+            # aiohttp errors don't pickle back to the parent, send the text
+            raise RuntimeError(f"{name} failed:\n{traceback.format_exc()}")
+
+    requests = sum(stats["requests"].values())
+    latencies = [
+        latency for client in TimedClient.instances for latency in client.latencies
+    ]
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000 if latencies else (0, 0)
+    return {
+        "scenario": name,
+        "requests": requests,
+        "throttled": sum(stats["throttled"].values()),
+        "seconds": round(seconds, 3),
+        "requests_per_s": round(requests / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(float(p50), 1),
+        "p99_ms": round(float(p99), 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Mock server did not start on port {port}")
+            time.sleep(0.05)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark against a mock API")
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--annotations", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds")
+    parser.add_argument("--datapoints", type=int, default=50, help="per content")
+    parser.add_argument("--padding", type=int, default=0, help="chars per value")
+    parser.add_argument("--throttle", type=float, default=0.0, help="share of 429")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--users", type=int, default=50, help="users_load rows")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    server_options = {
+        "annotations": args.annotations,
+        "latency": args.latency,
+        "datapoints": args.datapoints,
+        "padding": args.padding,
+        "throttle": args.throttle,
+    }
+    options = {"concurrency": args.concurrency, "users": args.users}
+
+    context = multiprocessing.get_context("spawn")
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = context.Process(target=serve, args=(port, server_options), daemon=True)
+    server.start()
+    results = []
+    try:
+        _wait_for_port(port)
+        for name in args.scenarios:
+            with context.Pool(1) as pool:
+                results.append(pool.apply(run_scenario, (name, base_url, options)))
+            print(pd.DataFrame(results[-1:]).to_string(index=False, header=False))
+    finally:
+        server.terminate()
+        server.join()
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"server": server_options, "results": results}, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,107 @@
 # annotation.py
 
+import sys
+
+# Datapoint keys kept when content trimming is on
+NODE_FIELDS = ("id", "schema_id", "category", "children", "content")
+CONTENT_FIELDS = ("value", "page", "position")
+
+
+def _last_part(url) -> str:
+    return sys.intern(str(url or "na").split("/")[-1])
+
+
+def trim_nodes(nodes: list) -> list:
+    """Copy a content tree keeping only the keys analyses use."""
+    trimmed = []
+    for node in nodes:
+        small = {key: node[key] for key in NODE_FIELDS if key in node}
+        small["schema_id"] = sys.intern(small["schema_id"])
+        if "category" in small:
+            small["category"] = sys.intern(small["category"])
+        if "content" in small:
+            small["content"] = {
+                key: node["content"][key]
+                for key in CONTENT_FIELDS
+                if key in node["content"]
+            }
+        if small.get("children"):
+            small["children"] = trim_nodes(small["children"])
+        trimmed.append(small)
+    return trimmed
+
 
 class Annotation:
+    """
+    One annotation with its metadata, content tree, pages and related emails.
+    Set Annotation.trim_content = True to keep only the datapoint keys listed
+    in NODE_FIELDS/CONTENT_FIELDS, and Annotation.metadata_fields to a list
+    of keys to drop the rest of the metadata, when holding many annotations.
+    """
+
+    __slots__ = (
+        "_metadata",
+        "_queue",
+        "_schema",
+        "_page_data",
+        "_related_emails",
+        "_annotation_data",
+        "_schema_index",
+        "_schema_paths",
+    )
+
+    trim_content = False
+    metadata_fields = None
+    # Always kept, the rest of the class (and archive/sync) relies on them
+    REQUIRED_METADATA = (
+        "id",
+        "queue",
+        "schema",
+        "related_emails",
+        "status",
+        "created_at",
+        "modified_at",
+    )
+
     def __init__(self, annotation_metadata: dict) -> None:
+        if Annotation.metadata_fields is not None:
+            keep = set(Annotation.metadata_fields) | set(Annotation.REQUIRED_METADATA)
+            annotation_metadata = {
+                key: value for key, value in annotation_metadata.items() if key in keep
+            }
         self._metadata = annotation_metadata
+        self._queue = _last_part(annotation_metadata.get("queue"))
+        self._schema = _last_part(annotation_metadata.get("schema"))
+        # (page_id, page number, width, height)
         self._page_data = []
         self._related_emails = []
         self._annotation_data = None
+        self._schema_index = None
+        self._schema_paths = None
+
+    def __getstate__(self):
+        # The schema index is rebuilt on demand, no need to store it
+        return {
+            "_metadata": self._metadata,
+            "_page_data": self._page_data,
+            "_related_emails": self._related_emails,
+            "_annotation_data": self._annotation_data,
+        }
+
+    def __setstate__(self, state):
+        # Also loads pickles made before __slots__, with dict page data
+        self.__init__(state["_metadata"])
+        self._related_emails = state.get("_related_emails", [])
+        self.annotation_content = state.get("_annotation_data")
+        for page in state.get("_page_data", []):
+            if isinstance(page, dict):
+                page = (
+                    page["page_id"],
+                    page["page"],
+                    page["page_width"],
+                    page["page_height"],
+                )
+            self._page_data.append(tuple(page))
 
     @property
     def id(self):
@@ -18,27 +113,35 @@ class Annotation:
 
     @property
     def queue(self):
-        return self.metadata.get("queue", "na").split("/")[-1]
+        return self._queue
 
     @property
     def schema(self):
-        return self.metadata.get("schema", "na").split("/")[-1]
+        return self._schema
 
     @property
-    def page_data(self):
+    def pages(self):
+        """Pages as (page_id, page number, width, height) tuples."""
         return self._page_data
 
+    @property
+    def page_data(self):
+        return [
+            {
+                "annotation_id": self.id,
+                "page_id": page_id,
+                "page": number,
+                "page_width": width,
+                "page_height": height,
+            }
+            for page_id, number, width, height in self._page_data
+        ]
+
     @page_data.setter
-    def page_data(self, page_meta):        
+    def page_data(self, page_meta):
         for result in page_meta:
             self._page_data.append(
-                {
-                    "annotation_id": self.id,
-                    "page_id": result["id"],
-                    "page": result["number"],
-                    "page_width": result["width"],
-                    "page_height": result["height"],
-                }
+                (result["id"], result["number"], result["width"], result["height"])
             )
 
     @property
@@ -66,4 +169,41 @@ class Annotation:
 
     @annotation_content.setter
     def annotation_content(self, annotation):
+        if annotation is not None and Annotation.trim_content:
+            annotation = trim_nodes(annotation)
         self._annotation_data = annotation
+        self._schema_index = None
+        self._schema_paths = None
+
+    def _build_schema_index(self) -> None:
+        # One pre-order walk of the content tree, same order as a recursive search
+        index = {}
+        paths = {}
+        stack = [(node, ()) for node in reversed(self._annotation_data or [])]
+        while stack:
+            node, path = stack.pop()
+            schema_id = node["schema_id"]
+            index.setdefault(schema_id, []).append(node)
+            paths.setdefault(schema_id, path)
+            children = node.get("children")
+            if children:
+                child_path = path + (schema_id,)
+                stack.extend((child, child_path) for child in reversed(children))
+        self._schema_index = index
+        self._schema_paths = paths
+
+    @property
+    def schema_index(self) -> dict:
+        """{schema_id: [datapoints]} for the whole content tree, built on first use."""
+        if self._schema_index is None:
+            self._build_schema_index()
+        return self._schema_index
+
+    def find_by_schema_id(self, schema_id: str) -> list:
+        return self.schema_index.get(schema_id, [])
+
+    def schema_path(self, schema_id: str) -> tuple:
+        """Parent schema ids of a field, e.g. ("line_items_section", "line_items")."""
+        if self._schema_paths is None:
+            self._build_schema_index()
+        return self._schema_paths.get(schema_id)
@@ -1,18 +1,106 @@
 # async_request_client.py
 
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+
 import aiohttp
 
+from rs_classes import json_backend
+from rs_classes.metrics import RequestMetrics
+from rs_classes.rate_limiter import AdaptiveLimiter
+from rs_classes.response_cache import MemoryCache, cache_key
+
+logger = logging.getLogger(__name__)
+
 
 class AsyncRequestClient:
     BASE_URL = "https://elis.rossum.ai/api"
     HEADERS = {
         "Content-Type": "application/json",
     }
+    # 429 is retried for any method, the rest only for idempotent requests
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    THROTTLE_STATUSES = {429, 503}
+    IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
 
-    def __init__(self, token=None, domain=None):
+    def __init__(
+        self,
+        token=None,
+        domain=None,
+        limit=100,
+        limit_per_host=100,
+        keepalive_timeout=30,
+        ttl_dns_cache=300,
+        timeout=300,
+        max_retries=5,
+        backoff_base=1,
+        backoff_max=60,
+        concurrency=50,
+        max_concurrency=100,
+        cache=None,
+        decode_threshold=json_backend.THREAD_THRESHOLD,
+        cassette=None,
+        metrics=None,
+    ):
         self._token = token
         self._base_url = domain or AsyncRequestClient.BASE_URL
-        self.request_cache = {}
+        # Any ResponseCache backend, e.g. SQLiteCache to keep responses on disk.
+        # The default keeps up to 256 MiB of raw response bytes in memory.
+        self.request_cache = (
+            cache if cache is not None else MemoryCache(max_bytes=256 * 1024**2)
+        )
+
+        # Connection pool settings. The session itself is created lazily on
+        # first request so the client can be built outside of a running loop.
+        self._connector_options = {
+            "limit": limit,
+            "limit_per_host": limit_per_host,
+            "keepalive_timeout": keepalive_timeout,
+            "ttl_dns_cache": ttl_dns_cache,
+        }
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session = None
+
+        # Retries and adaptive concurrency shared by every request
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = AdaptiveLimiter(initial=concurrency, maximum=max_concurrency)
+
+        # Response bodies this big (bytes) are decoded in a worker thread
+        self.decode_threshold = decode_threshold
+
+        # Per-endpoint counters and latencies, see RequestMetrics.summary()
+        self.metrics = metrics if metrics is not None else RequestMetrics()
+
+        # Cassette to record responses to, or to replay them from
+        self.cassette = cassette
+
+        # Cacheable requests in flight by cache key, shared by identical callers
+        self._in_flight = {}
+
+    async def __aenter__(self):
+        self._get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(**self._connector_options)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self._timeout
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     @property
     def token(self):
@@ -50,47 +138,232 @@ class AsyncRequestClient:
         files=None,
         cache_on=True,
         ready_url=None,
+        retry=None,
     ):
         url = ready_url or f"{self.base_url}/v1{endpoint}"
-        headers = headers or AsyncRequestClient.HEADERS
-        headers["Authorization"] = f"Bearer {self.token}"
+        key = cache_key(method, url, json if json is not None else data)
+        self.metrics.call(method, url)
+        if self.cassette is None:
+            return await self._coalesced(
+                key, method, url, headers, data, json, cache_on, retry
+            )
+
+        # Replay never touches the network; recording keeps what callers got
+        if self.cassette.replaying:
+            return await self.cassette.play(key)
+        start = time.perf_counter()
+        response = await self._coalesced(
+            key, method, url, headers, data, json, cache_on, retry
+        )
+        self.cassette.record(key, method, url, response, time.perf_counter() - start)
+        return response
 
-        if self.request_cache.get(url, False) and cache_on:
-            if self.request_cache[url]["json"] == json:
-                print(f"Cached {url}")
-                return self.request_cache[url]["response"]
+    async def _coalesced(self, key, method, url, headers, data, json, cache_on, retry):
+        if not cache_on:
+            return await self._fetch(
+                key, method, url, headers, data, json, cache_on, retry
+            )
 
-        async with aiohttp.ClientSession() as session:
+        # Single flight: concurrent identical requests await one shared task
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._fetch(key, method, url, headers, data, json, cache_on, retry)
+            )
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._request_done(key, done))
+        else:
+            self.metrics.coalesced(method, url)
+            logger.debug("Joined in-flight %s", url)
+        # Shielded, so one cancelled caller doesn't cancel the others
+        return await asyncio.shield(task)
+
+    def _request_done(self, key: str, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Callers get the exception; retrieve it so an orphaned task stays quiet
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch(self, key, method, url, headers, data, json, cache_on, retry):
+        headers = dict(headers or AsyncRequestClient.HEADERS)
+        headers["Authorization"] = f"Bearer {self.token}"
+
+        cached = self.request_cache.get(key) if cache_on else None
+        if cached is not None:
+            if self.request_cache.is_fresh(cached):
+                self.metrics.cache_hit(method, url)
+                logger.debug("Cached %s", url)
+                return cached["response"]
+            # Stale entry: let the server tell us if it's still valid
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        if retry is None:
+            retry = method.upper() in AsyncRequestClient.IDEMPOTENT_METHODS
+
+        session = self._get_session()
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            queued_at = time.perf_counter()
+            async with self.limiter:
+                start = time.perf_counter()
+                self.metrics.queued(method, url, start - queued_at)
+                try:
+                    async with session.request(
+                        method,
+                        url,
+                        headers=headers,
+                        data=data,
+                        json=json,
+                    ) as response:
+                        if response.status == 304 and cached is not None:
+                            self.limiter.on_success()
+                            self._observe(method, url, response.status, start)
+                            logger.debug("Not modified %s", url)
+                            self.request_cache.set(
+                                key,
+                                self.request_cache.make_entry(
+                                    url,
+                                    cached["response"],
+                                    etag=cached["etag"],
+                                    last_modified=cached["last_modified"],
+                                    size=cached.get("size"),
+                                ),
+                            )
+                            return cached["response"]
+
+                        if response.status == 200 or response.status == 201:
+                            self.limiter.on_success()
+                            # Read once, decode once
+                            body = await response.read()
+                            self._observe(method, url, response.status, start, body)
+                            result = (
+                                await json_backend.loads_async(
+                                    body, self.decode_threshold
+                                )
+                                if body
+                                else None
+                            )
+                            if cache_on:
+                                self.request_cache.set(
+                                    key,
+                                    self.request_cache.make_entry(
+                                        url,
+                                        result,
+                                        etag=response.headers.get("ETag"),
+                                        last_modified=response.headers.get(
+                                            "Last-Modified"
+                                        ),
+                                        size=len(body),
+                                        body=body,
+                                    ),
+                                )
+                            return result
+
+                        self._observe(method, url, response.status, start)
+                        retryable = response.status == 429 or (
+                            retry
+                            and response.status in AsyncRequestClient.RETRY_STATUSES
+                        )
+                        if not retryable or last_attempt:
+                            self.metrics.error(method, url)
+                            logger.warning("%s %s failed: %s", method, url, response)
+                            response.raise_for_status()
+                            return None
+
+                        retry_after = self._retry_after(
+                            response.headers.get("Retry-After")
+                        )
+                        delay = self._retry_delay(attempt, retry_after)
+                        throttled = (
+                            response.status in AsyncRequestClient.THROTTLE_STATUSES
+                        )
+                        if throttled:
+                            # Everyone pauses for what the server asked, only
+                            # this request's own retry is jittered
+                            self.limiter.on_throttle(retry_after)
+                        self.metrics.retry(method, url, delay, throttled)
+                        logger.info(
+                            "%s on %s, retry in %.1fs", response.status, url, delay
+                        )
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    self._observe(method, url, type(e).__name__, start)
+                    if not retry or last_attempt:
+                        self.metrics.error(method, url)
+                        raise
+                    delay = self._retry_delay(attempt)
+                    self.metrics.retry(method, url, delay, throttled=False)
+                    logger.info("%r on %s, retry in %.1fs", e, url, delay)
+
+            await asyncio.sleep(delay)
+
+    def _observe(self, method, url, status, start: float, body: bytes = b"") -> None:
+        seconds = time.perf_counter() - start
+        self.metrics.response(method, url, status, seconds, len(body))
+        logger.debug("%s %s %s %.3fs", method, url, status, seconds)
+
+    @staticmethod
+    def _retry_after(header: str = None) -> float:
+        """Seconds from a Retry-After header (seconds or HTTP date), 0 if none."""
+        if not header:
+            return 0
+        try:
+            delay = float(header)
+        except ValueError:
             try:
-                async with session.request(
-                    method,
-                    url,
-                    headers=headers,
-                    data=data,
-                    json=json,
-                ) as response:
-                    print(url, "  Request")
-                    if response.status == 200 or response.status == 201:
-                        self.request_cache[url] = {
-                            "response": await response.json(),
-                            "json": json,
-                        }
-                        return await response.json()
-                    else:
-                        print(response)
-                        raise aiohttp.ClientResponseError
-            except aiohttp.ClientResponseError as e:
-                print("ClientResponseError occurred:", e)
-
-    async def _get_annotation_content(self, annotation_id):
+                delay = parsedate_to_datetime(header).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = 0
+        return max(delay, 0)
+
+    def _retry_delay(self, attempt: int, retry_after: float = 0) -> float:
+        if retry_after > 0:
+            # Jitter on top of the server's wait spreads the retries out
+            return retry_after + random.uniform(0, min(1, retry_after))
+
+        # Exponential backoff with full jitter
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2**attempt)
+        )
+
+    async def _get_annotation_content(self, annotation_id, cache_on: bool = True):
         endpoint = f"/annotations/{annotation_id}/content"
-        response = await self._make_request("GET", endpoint, cache_on=True)
+        response = await self._make_request("GET", endpoint, cache_on=cache_on)
         return response
 
-    async def _get_annotations_meta(self, annotation_list: str, next_page=None):
-        endpoint = f"/annotations/?id={annotation_list}"
+    @staticmethod
+    def _sideload_params(sideload: list = None, content_schema_ids: list = None) -> str:
+        # e.g. "&sideload=content,pages&content.schema_id=sender_name"
+        params = ""
+        if sideload:
+            params += f"&sideload={','.join(sideload)}"
+        if content_schema_ids:
+            params += f"&content.schema_id={','.join(content_schema_ids)}"
+        return params
+
+    async def _get_annotations_meta_page(
+        self,
+        annotation_list: str,
+        next_page=None,
+        sideload: list = None,
+        content_schema_ids: list = None,
+        cache_on: bool = True,
+    ) -> dict:
+        # Full listing response, including sideloaded content/pages
+        endpoint = (
+            f"/annotations/?id={annotation_list}&page_size=100"
+        ) + self._sideload_params(sideload, content_schema_ids)
         response = await self._make_request(
-            "GET", endpoint, cache_on=True, ready_url=next_page
+            "GET", endpoint, cache_on=cache_on, ready_url=next_page
+        )
+        return response
+
+    async def _get_annotations_meta(self, annotation_list: str, next_page=None):
+        response = await self._get_annotations_meta_page(
+            annotation_list, next_page=next_page
         )
 
         pagination = response["pagination"]
@@ -98,21 +371,42 @@ class AsyncRequestClient:
 
         return next_page, response["results"]
 
-    async def _search(self, params=None, next_page=None) -> tuple:
-        endpoint = "/annotations/search?page_size=100"
+    async def _search_page(
+        self,
+        params=None,
+        next_page=None,
+        sideload: list = None,
+        content_schema_ids: list = None,
+        cache_on: bool = True,
+        page_size: int = 100,
+    ) -> dict:
+        # Full search response, including pagination totals and sideloads
+        endpoint = f"/annotations/search?page_size={page_size}"
+        endpoint += self._sideload_params(sideload, content_schema_ids)
         response = await self._make_request(
-            "POST", endpoint, json=params, cache_on=True, ready_url=next_page
+            "POST",
+            endpoint,
+            json=params,
+            cache_on=cache_on,
+            ready_url=next_page,
+            retry=True,
         )
+        return response
+
+    async def _search(self, params=None, next_page=None) -> tuple:
+        response = await self._search_page(params=params, next_page=next_page)
 
         pagination = response["pagination"]
         next_page = pagination.get("next", False)
 
         return next_page, response["results"]
 
-    async def _get_pages(self, annotation_id: str, next_page: str = None) -> tuple:
+    async def _get_pages(
+        self, annotation_id: str, next_page: str = None, cache_on: bool = True
+    ) -> tuple:
         endpoint = f"/pages?annotation={annotation_id}"
         response = await self._make_request(
-            "GET", endpoint, cache_on=True, ready_url=next_page
+            "GET", endpoint, cache_on=cache_on, ready_url=next_page
         )
 
         pagination = response["pagination"]
@@ -120,9 +414,25 @@ class AsyncRequestClient:
 
         return next_page, response["results"]
 
-    async def _get_email(self, email_id: str) -> dict:
+    async def _get_pages_listing(
+        self,
+        annotation_ids: str,
+        page_number: int = None,
+        next_page: str = None,
+        cache_on: bool = True,
+    ) -> dict:
+        # Pages of many annotations at once, "annotation_ids" is comma separated
+        endpoint = f"/pages?annotation={annotation_ids}&page_size=100"
+        if page_number:
+            endpoint += f"&page={page_number}"
+        response = await self._make_request(
+            "GET", endpoint, cache_on=cache_on, ready_url=next_page
+        )
+        return response
+
+    async def _get_email(self, email_id: str, cache_on: bool = True) -> dict:
         endpoint = f"/emails/{email_id}"
-        response = await self._make_request("GET", endpoint, cache_on=True)
+        response = await self._make_request("GET", endpoint, cache_on=cache_on)
 
         return response
 
@@ -250,7 +560,7 @@ class AsyncRequestClient:
         }
 
         response = await self._make_request(
-            "POST", ready_url=url, json=data, cache_on=False
+            "POST", ready_url=url, json=data, cache_on=False, retry=True
         )
 
         return response
@@ -276,7 +586,7 @@ class AsyncRequestClient:
         }
 
         response = await self._make_request(
-            "POST", ready_url=url, json=data, cache_on=False
+            "POST", ready_url=url, json=data, cache_on=False, retry=True
         )
 
         return response
@@ -0,0 +1,86 @@
+# cassette.py
+
+import asyncio
+import sqlite3
+import time
+import zlib
+
+from rs_classes import json_backend
+
+
+class CassetteMiss(KeyError):
+    """Replay asked for a request that was never recorded."""
+
+
+class Cassette:
+    """
+    Request/response pairs of AsyncRequestClient in a single SQLite file.
+    In "record" mode every response returned by _make_request is stored
+    (zlib compressed JSON) with the time it took; in "replay" mode requests
+    are answered from the file only, keyed by method, url and body.
+    :param mode: "record" or "replay"
+    :param timing: on replay, wait as long as the recorded request took
+    """
+
+    MODES = ("record", "replay")
+
+    def __init__(self, path: str, mode: str = "replay", timing: bool = False):
+        if mode not in Cassette.MODES:
+            raise ValueError(f"mode must be one of {Cassette.MODES}")
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS interactions (
+                key TEXT PRIMARY KEY,
+                method TEXT,
+                url TEXT,
+                response BLOB,
+                elapsed REAL,
+                recorded_at REAL
+            )
+            """
+        )
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def record(self, key: str, method: str, url: str, response, elapsed: float):
+        body = zlib.compress(json_backend.dumps(response).encode())
+        self._connection.execute(
+            "INSERT OR REPLACE INTO interactions VALUES (?, ?, ?, ?, ?, ?)",
+            (key, method.upper(), url, body, elapsed, time.time()),
+        )
+
+    async def play(self, key: str):
+        row = self._connection.execute(
+            "SELECT response, elapsed FROM interactions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            raise CassetteMiss(key)
+        body, elapsed = row
+        if self.timing and elapsed:
+            await asyncio.sleep(elapsed)
+        return json_backend.loads(zlib.decompress(body))
+
+    def stats(self) -> dict:
+        count, size, elapsed = self._connection.execute(
+            "SELECT COUNT(*), SUM(LENGTH(response)), SUM(elapsed) FROM interactions"
+        ).fetchone()
+        return {
+            "interactions": count,
+            "bytes": size or 0,
+            "recorded_seconds": round(elapsed or 0, 3),
+        }
+
+    def __len__(self):
+        row = self._connection.execute("SELECT COUNT(*) FROM interactions").fetchone()
+        return row[0]
+
+    def close(self) -> None:
+        self._connection.close()
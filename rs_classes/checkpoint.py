@@ -0,0 +1,116 @@
+# checkpoint.py
+
+import hashlib
+import json
+import sqlite3
+
+
+def job_key(kind: str, *parts) -> str:
+    """Job id derived from what the job fetches, e.g. job_key("content", ids)."""
+    digest = hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f"{kind}:{digest[:16]}"
+
+
+class CheckpointStore:
+    """
+    SQLite store of finished items per job. Fetch functions save every item
+    as soon as it arrives and skip items already saved for the same job id,
+    so an interrupted bulk fetch resumes where it stopped. A job is cleared
+    once it finishes, so fetching the same data again later (another day)
+    gets it fresh instead of the old items; only a job_id passed explicitly
+    to get_annotation_content/get_annotations_page is left for the caller
+    to clear.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                job_id TEXT,
+                item_key TEXT,
+                result TEXT,
+                PRIMARY KEY (job_id, item_key)
+            )
+            """
+        )
+
+    def load(self, job_id: str, keys: list = None) -> dict:
+        """
+        Finished items of a job, {item_key: result}.
+        :param keys: only look these items up instead of reading the whole job
+        """
+        if keys is None:
+            rows = self._connection.execute(
+                "SELECT item_key, result FROM items WHERE job_id = ?", (job_id,)
+            )
+            return {item_key: json.loads(result) for item_key, result in rows}
+
+        keys = [str(key) for key in keys]
+        finished = {}
+        # Stay below SQLite's limit of bound parameters per statement
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            rows = self._connection.execute(
+                "SELECT item_key, result FROM items WHERE job_id = ? "
+                f"AND item_key IN ({', '.join('?' * len(chunk))})",
+                (job_id, *chunk),
+            )
+            finished.update((item_key, json.loads(result)) for item_key, result in rows)
+        return finished
+
+    def save(self, job_id: str, item_key, result) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO items VALUES (?, ?, ?)",
+            (job_id, str(item_key), json.dumps(result)),
+        )
+
+    def clear(self, job_id: str) -> None:
+        self._connection.execute("DELETE FROM items WHERE job_id = ?", (job_id,))
+
+    def jobs(self) -> dict:
+        """{job_id: number of finished items}"""
+        rows = self._connection.execute(
+            "SELECT job_id, COUNT(*) FROM items GROUP BY job_id"
+        )
+        return dict(rows.fetchall())
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+async def run_checkpointed(
+    checkpoint: CheckpointStore, kind: str, job_id: str, keys: list, restore, fetch
+) -> None:
+    """
+    Await fetch(keys, store) for the keys a job hasn't finished yet.
+    Items an earlier run of the job already finished are handed to
+    restore(key, result) instead; store(key, result) restores every new
+    result and checkpoints it. Without a checkpoint store is just restore.
+    :param kind: job id prefix when job_id is None, e.g. "content"; such a
+        job is cleared once fetch finishes
+    """
+    if checkpoint is None:
+        await fetch(keys, restore)
+        return
+
+    # Resume: reuse what an earlier run of the same job already fetched
+    owned = job_id is None
+    job_id = job_id or job_key(kind, keys)
+    finished = checkpoint.load(job_id, keys)
+    for key in keys:
+        if str(key) in finished:
+            restore(key, finished[str(key)])
+
+    def store(key, result):
+        restore(key, result)
+        checkpoint.save(job_id, key, result)
+
+    await fetch([key for key in keys if str(key) not in finished], store)
+    if owned:
+        checkpoint.clear(job_id)
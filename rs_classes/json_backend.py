@@ -0,0 +1,40 @@
+# json_backend.py
+
+import asyncio
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib decoder is the fallback
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+# Payloads at least this big (bytes) are decoded off the event loop
+THREAD_THRESHOLD = 1024 * 1024
+
+
+def loads(data):
+    """Decode JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    """Encode to a JSON string."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+async def loads_async(data, threshold: int = THREAD_THRESHOLD):
+    """
+    Decode JSON, in a worker thread when the payload is large so the event
+    loop keeps scheduling requests meanwhile.
+    :param threshold: size in bytes from which decoding is offloaded,
+        None never offloads
+    """
+    if threshold is not None and len(data) >= threshold:
+        return await asyncio.to_thread(loads, data)
+    return loads(data)
@@ -0,0 +1,397 @@
+# metrics.py
+
+import bisect
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, the last bucket catches everything above
+LATENCY_BUCKETS = (
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    float("inf"),
+)
+ID_SEGMENT = re.compile(r"^\d+$")
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """e.g. "GET /annotations/{id}/content" for any annotation id."""
+    path = urlsplit(url).path
+    if "/v1/" in path:
+        path = path.split("/v1", 1)[1]
+    parts = ["{id}" if ID_SEGMENT.match(part) else part for part in path.split("/")]
+    return f"{method.upper()} {'/'.join(parts).rstrip('/') or '/'}"
+
+
+class Histogram:
+    """Fixed bucket histogram, quantiles are interpolated within a bucket."""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i]
+                if upper == float("inf"):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-2]
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+class EndpointStats:
+    """Counters of one endpoint (method + path with ids replaced)."""
+
+    def __init__(self) -> None:
+        self.calls = 0  # _make_request calls
+        self.cache_hits = 0
+        self.not_modified = 0
+        self.coalesced = 0
+        self.requests = 0  # HTTP requests sent, retries included
+        self.retries = 0
+        self.errors = 0
+        self.bytes = 0
+        self.statuses = Counter()
+        self.latency = Histogram()
+        # Summed over requests, so they can exceed the wall clock time
+        self.throttle_wait = 0.0  # seconds slept on 429/503 before retrying
+        self.queue_wait = 0.0  # seconds waited for a concurrency slot
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        return self.cache_hits / self.calls if self.calls else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "cache_hit_ratio": round(self.cache_hit_ratio, 3),
+            "not_modified": self.not_modified,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "statuses": dict(self.statuses),
+            "latency_mean_s": round(self.latency.mean, 4),
+            "latency_p50_s": round(self.latency.quantile(0.5), 4),
+            "latency_p99_s": round(self.latency.quantile(0.99), 4),
+            "throttle_wait_s": round(self.throttle_wait, 3),
+            "queue_wait_s": round(self.queue_wait, 3),
+        }
+
+
+class RequestMetrics:
+    """
+    Per-endpoint request metrics of an AsyncRequestClient.
+    :param exporters: objects with an export(metrics) method, e.g.
+        LogExporter, JSONExporter, PrometheusExporter
+    :param export_interval: also export every this many seconds while
+        requests keep coming, None only exports on export()
+    :param progress: show a live one-line status (ipywidgets in a notebook,
+        a log line otherwise)
+    """
+
+    def __init__(
+        self, exporters: list = None, export_interval: float = None, progress=False
+    ) -> None:
+        self.exporters = list(exporters or [])
+        self.export_interval = export_interval
+        self.endpoints = {}
+        self.started_at = None
+        self._last_export = time.monotonic()
+        self._progress = ProgressDisplay() if progress else None
+
+    def _stats(self, method: str, url: str) -> EndpointStats:
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        name = endpoint_name(method, url)
+        stats = self.endpoints.get(name)
+        if stats is None:
+            stats = self.endpoints[name] = EndpointStats()
+        return stats
+
+    def call(self, method: str, url: str) -> None:
+        self._stats(method, url).calls += 1
+
+    def cache_hit(self, method: str, url: str) -> None:
+        self._stats(method, url).cache_hits += 1
+        self._tick()
+
+    def coalesced(self, method: str, url: str) -> None:
+        self._stats(method, url).coalesced += 1
+
+    def queued(self, method: str, url: str, seconds: float) -> None:
+        self._stats(method, url).queue_wait += seconds
+
+    def response(self, method: str, url: str, status, seconds: float, size=0) -> None:
+        """One HTTP request; status is the exception name if none came back."""
+        stats = self._stats(method, url)
+        stats.requests += 1
+        stats.statuses[status] += 1
+        stats.latency.observe(seconds)
+        stats.bytes += size
+        if status == 304:
+            stats.not_modified += 1
+        self._tick()
+
+    def retry(self, method: str, url: str, delay: float, throttled: bool) -> None:
+        stats = self._stats(method, url)
+        stats.retries += 1
+        if throttled:
+            stats.throttle_wait += delay
+
+    def error(self, method: str, url: str) -> None:
+        self._stats(method, url).errors += 1
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at if self.started_at else 0.0
+
+    def totals(self) -> dict:
+        endpoints = self.endpoints.values()
+        calls = sum(stats.calls for stats in endpoints)
+        cache_hits = sum(stats.cache_hits for stats in endpoints)
+        requests = sum(stats.requests for stats in endpoints)
+        elapsed = self.elapsed
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "calls": calls,
+            "requests": requests,
+            "requests_per_s": round(requests / elapsed, 1) if elapsed else 0.0,
+            "cache_hits": cache_hits,
+            "cache_hit_ratio": round(cache_hits / calls, 3) if calls else 0.0,
+            "coalesced": sum(stats.coalesced for stats in endpoints),
+            "retries": sum(stats.retries for stats in endpoints),
+            "errors": sum(stats.errors for stats in endpoints),
+            "bytes": sum(stats.bytes for stats in endpoints),
+            "request_time_s": round(sum(s.latency.sum for s in endpoints), 3),
+            "throttle_wait_s": round(sum(s.throttle_wait for s in endpoints), 3),
+            "queue_wait_s": round(sum(s.queue_wait for s in endpoints), 3),
+        }
+
+    def summary(self) -> dict:
+        """{"totals": {...}, "endpoints": {endpoint: {...}}}, busiest first."""
+        endpoints = sorted(
+            self.endpoints.items(), key=lambda item: -item[1].latency.sum
+        )
+        return {
+            "totals": self.totals(),
+            "endpoints": {name: stats.as_dict() for name, stats in endpoints},
+        }
+
+    def report(self) -> str:
+        """Summary as a plain text table."""
+        totals = self.totals()
+        lines = [
+            f"{totals['requests']} requests in {totals['elapsed_s']:.1f}s "
+            f"({totals['requests_per_s']}/s), cache hit ratio "
+            f"{totals['cache_hit_ratio']:.1%}, {totals['retries']} retries, "
+            f"{totals['throttle_wait_s']:.1f}s throttled, "
+            f"{totals['bytes'] / 1024**2:.1f} MiB",
+            f"{'endpoint':45} {'calls':>7} {'reqs':>7} {'hit%':>6} {'retry':>6} "
+            f"{'p50 s':>7} {'p99 s':>7} {'time s':>8} {'MiB':>7}",
+        ]
+        for name, stats in self.summary()["endpoints"].items():
+            lines.append(
+                f"{name[:45]:45} {stats['calls']:>7} {stats['requests']:>7} "
+                f"{stats['cache_hit_ratio']:>6.1%} {stats['retries']:>6} "
+                f"{stats['latency_p50_s']:>7.3f} {stats['latency_p99_s']:>7.3f} "
+                f"{self.endpoints[name].latency.sum:>8.1f} "
+                f"{stats['bytes'] / 1024**2:>7.1f}"
+            )
+        return "\n".join(lines)
+
+    def export(self) -> None:
+        self._last_export = time.monotonic()
+        for exporter in self.exporters:
+            exporter.export(self)
+
+    def reset(self) -> None:
+        self.endpoints = {}
+        self.started_at = None
+
+    def _tick(self) -> None:
+        if self._progress is not None:
+            self._progress.update(self)
+        if (
+            self.export_interval is not None
+            and time.monotonic() - self._last_export >= self.export_interval
+        ):
+            self.export()
+
+
+class LogExporter:
+    """One log line with the totals and one per endpoint."""
+
+    def __init__(self, log: logging.Logger = None, level: int = logging.INFO):
+        self.log = log or logger
+        self.level = level
+
+    def export(self, metrics: RequestMetrics) -> None:
+        summary = metrics.summary()
+        self.log.log(self.level, "requests %s", json.dumps(summary["totals"]))
+        for name, stats in summary["endpoints"].items():
+            self.log.log(self.level, "%s %s", name, json.dumps(stats))
+
+
+class JSONExporter:
+    """Write the summary to a JSON file, replaced on every export."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def export(self, metrics: RequestMetrics) -> None:
+        with open(self.path, "w") as file:
+            json.dump(metrics.summary(), file, indent=1)
+
+
+def prometheus_text(metrics: RequestMetrics, prefix: str = "rossum_client") -> str:
+    """Metrics in the Prometheus text exposition format."""
+
+    def label(name, **extra):
+        labels = {"endpoint": name, **extra}
+        return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+    lines = []
+
+    def family(metric, kind, help_text, samples):
+        lines.append(f"# HELP {prefix}_{metric} {help_text}")
+        lines.append(f"# TYPE {prefix}_{metric} {kind}")
+        lines.extend(f"{prefix}_{sample}" for sample in samples)
+
+    endpoints = metrics.endpoints.items()
+    counters = [
+        ("calls_total", "calls", "Requests asked for, cache hits included"),
+        ("cache_hits_total", "cache_hits", "Answered from the response cache"),
+        ("coalesced_total", "coalesced", "Joined an identical in-flight request"),
+        ("retries_total", "retries", "Requests retried"),
+        ("errors_total", "errors", "Requests failed for good"),
+        ("response_bytes_total", "bytes", "Response body bytes received"),
+        ("throttle_wait_seconds_total", "throttle_wait", "Slept on 429/503"),
+        ("queue_wait_seconds_total", "queue_wait", "Waited for a concurrency slot"),
+    ]
+    for metric, attribute, help_text in counters:
+        family(
+            metric,
+            "counter",
+            help_text,
+            [
+                f"{metric}{{{label(name)}}} {getattr(stats, attribute)}"
+                for name, stats in endpoints
+            ],
+        )
+    family(
+        "requests_total",
+        "counter",
+        "HTTP requests sent by status, retries included",
+        [
+            f"requests_total{{{label(name, status=status)}}} {count}"
+            for name, stats in endpoints
+            for status, count in sorted(stats.statuses.items(), key=str)
+        ],
+    )
+
+    samples = []
+    for name, stats in endpoints:
+        histogram = stats.latency
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else bound
+            samples.append(
+                f"request_seconds_bucket{{{label(name, le=le)}}} {cumulative}"
+            )
+        samples.append(f"request_seconds_sum{{{label(name)}}} {histogram.sum}")
+        samples.append(f"request_seconds_count{{{label(name)}}} {histogram.count}")
+    family("request_seconds", "histogram", "HTTP request latency", samples)
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusExporter:
+    """Write prometheus_text to a file, e.g. for node_exporter's textfile collector."""
+
+    def __init__(self, path: str, prefix: str = "rossum_client") -> None:
+        self.path = path
+        self.prefix = prefix
+
+    def export(self, metrics: RequestMetrics) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(prometheus_text(metrics, self.prefix))
+        os.replace(tmp_path, self.path)
+
+
+class ProgressDisplay:
+    """
+    Live one-line status: an ipywidgets label when available, otherwise a
+    log line every log_interval seconds.
+    """
+
+    def __init__(self, interval: float = 0.5, log_interval: float = 30) -> None:
+        self.interval = interval
+        self.log_interval = log_interval
+        self._last = 0.0
+        self._widget = None
+        try:
+            import ipywidgets
+            from IPython import get_ipython
+            from IPython.display import display
+
+            if get_ipython() is not None:
+                self._widget = ipywidgets.HTML()
+                display(self._widget)
+        except ImportError:
+            pass
+
+    def update(self, metrics: RequestMetrics) -> None:
+        now = time.monotonic()
+        interval = self.interval if self._widget is not None else self.log_interval
+        if now - self._last < interval:
+            return
+        self._last = now
+        totals = metrics.totals()
+        text = (
+            f"{totals['requests']} requests ({totals['requests_per_s']}/s), "
+            f"{totals['cache_hits']} cached, {totals['retries']} retries, "
+            f"{totals['errors']} errors, {totals['bytes'] / 1024**2:.1f} MiB, "
+            f"{totals['elapsed_s']:.0f}s"
+        )
+        if self._widget is not None:
+            self._widget.value = f"<code>{text}</code>"
+        else:
+            logger.info(text)
@@ -0,0 +1,147 @@
+# profiler.py
+
+import contextlib
+import gc
+import time
+import tracemalloc
+
+import pandas as pd
+
+
+class StageRecord:
+    """Totals of every run of one stage."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak = 0  # bytes above the memory in use when the stage started
+        self.retained = 0  # bytes still allocated when the stage ended
+        self.objects = 0  # change in gc tracked objects
+
+
+class StageProfiler:
+    """
+    Opt-in wall time, CPU time, memory and object accounting per named stage.
+
+        profiler = StageProfiler()
+        with profiler.stage("text_value_analysis"):
+            df = text_value_analysis(...)
+        profiler.summary()
+
+    Stages with the same name add up. Stages may nest or overlap (e.g.
+    content and pages fetched concurrently): wall and CPU time then count
+    for every open stage, and a memory peak is attributed to every stage
+    open while it happened.
+    :param memory: trace allocations with tracemalloc (slows allocation)
+    :param objects: count gc tracked objects before/after every stage,
+        costs a full heap walk per stage run
+    """
+
+    def __init__(self, memory: bool = True, objects: bool = True) -> None:
+        self.memory = memory
+        self.objects = objects
+        self.stages = {}
+        self._open = []
+        self._started_tracing = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def _fold_peak(self) -> int:
+        # Hand the peak since the last reset to every open stage, then reset
+        # it so each stage only sees peaks from its own lifetime
+        current, peak = tracemalloc.get_traced_memory()
+        for run in self._open:
+            run["peak"] = max(run["peak"], peak)
+        tracemalloc.reset_peak()
+        return current
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        run = {"peak": 0}
+        if self.memory:
+            run["memory"] = run["peak"] = self._fold_peak()
+        if self.objects:
+            run["objects"] = len(gc.get_objects())
+        self._open.append(run)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            record = self.stages.get(name)
+            if record is None:
+                record = self.stages[name] = StageRecord()
+            record.calls += 1
+            record.wall += time.perf_counter() - wall
+            record.cpu += time.process_time() - cpu
+            if self.memory:
+                current = self._fold_peak()
+                record.peak = max(record.peak, run["peak"] - run["memory"])
+                record.retained += current - run["memory"]
+            self._open.remove(run)
+            if self.objects:
+                record.objects += len(gc.get_objects()) - run["objects"]
+
+    async def iterate(self, name: str, iterator):
+        """Re-yield an async iterator, profiling the wait for every item."""
+        try:
+            while True:
+                with self.stage(name):
+                    try:
+                        item = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                yield item
+        finally:
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+
+    def summary(self) -> pd.DataFrame:
+        """One row per stage, in the order the stages first ran."""
+        return pd.DataFrame(
+            [
+                {
+                    "stage": name,
+                    "calls": record.calls,
+                    "wall_s": round(record.wall, 3),
+                    "cpu_s": round(record.cpu, 3),
+                    "peak_mib": round(record.peak / 1024**2, 1),
+                    "retained_mib": round(record.retained / 1024**2, 1),
+                    "objects": record.objects,
+                }
+                for name, record in self.stages.items()
+            ],
+            columns=[
+                "stage",
+                "calls",
+                "wall_s",
+                "cpu_s",
+                "peak_mib",
+                "retained_mib",
+                "objects",
+            ],
+        ).set_index("stage")
+
+    def reset(self) -> None:
+        self.stages = {}
+
+    def stop(self) -> None:
+        """Stop tracemalloc if this profiler started it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+def profile_stage(profiler: StageProfiler, name: str):
+    """profiler.stage(name), or a no-op without a profiler."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name)
+
+
+async def run_stage(profiler: StageProfiler, name: str, awaitable):
+    """Await under profile_stage."""
+    with profile_stage(profiler, name):
+        return await awaitable
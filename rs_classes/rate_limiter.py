@@ -0,0 +1,105 @@
+# rate_limiter.py
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Requests-per-second limiter. Allows bursts of up to `capacity` calls."""
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        self._rate = rate
+        self._capacity = capacity or rate
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self._capacity, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit shared by all requests of a client.
+    The limit grows by roughly one slot per round of successful requests and
+    is cut by `decrease_factor` when the API throttles us. A throttle with a
+    Retry-After pauses every new request until the given time.
+    """
+
+    def __init__(
+        self,
+        initial: int = 50,
+        minimum: int = 1,
+        maximum: int = 100,
+        decrease_factor: float = 0.5,
+        cooldown: float = 1.0,
+    ) -> None:
+        self._limit = float(initial)
+        self._minimum = minimum
+        self._maximum = maximum
+        self._decrease_factor = decrease_factor
+        self._cooldown = cooldown
+        self._in_flight = 0
+        self._resume_at = 0.0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+        # Honour a pause set while we were queued for a slot
+        delay = self._resume_at - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._resume_at - time.monotonic()
+
+    async def release(self) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+    def on_success(self) -> None:
+        self._limit = min(self._maximum, self._limit + 1 / self._limit)
+
+    def on_throttle(self, retry_after: float = 0) -> None:
+        now = time.monotonic()
+        self._resume_at = max(self._resume_at, now + retry_after)
+        # One burst of 429s should only shrink the window once
+        if now - self._last_decrease >= self._cooldown:
+            self._limit = max(self._minimum, self._limit * self._decrease_factor)
+            self._last_decrease = now
@@ -0,0 +1,316 @@
+# response_cache.py
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from rs_classes import json_backend
+
+# (url path pattern, ttl in seconds). First match wins, None never expires.
+DEFAULT_TTLS = [
+    ("*/queues*", 24 * 3600),
+    ("*/schemas*", 24 * 3600),
+    ("*/hooks*", 24 * 3600),
+    ("*/groups*", 24 * 3600),
+    ("*/pages*", 24 * 3600),
+    ("*/emails/*", 24 * 3600),
+    ("*/annotations/*/content", 3600),
+    ("*/annotations/search*", 15 * 60),
+    ("*", 3600),
+]
+
+
+def cache_key(method: str, url: str, body=None) -> str:
+    """Stable key from method, url and a hash of the request body."""
+    body_hash = hashlib.sha256(
+        json.dumps(body, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f"{method.upper()} {url} {body_hash}"
+
+
+class ResponseCache:
+    """
+    Base class for response cache backends.
+    Entries are dicts with keys: response, etag, last_modified, stored_at,
+    expires_at. Expired entries are still returned by get() so the client
+    can revalidate them with a conditional request.
+    """
+
+    def __init__(self, ttls: list = None) -> None:
+        self.ttls = ttls
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def ttl_for(self, url: str):
+        if self.ttls is None:
+            return None
+        path = urlsplit(url).path
+        for pattern, ttl in self.ttls:
+            if fnmatch.fnmatch(path, pattern):
+                return ttl
+        return None
+
+    def make_entry(
+        self, url: str, response, etag=None, last_modified=None, size=None, body=None
+    ) -> dict:
+        """:param body: raw response bytes, saves backends re-encoding response"""
+        now = time.time()
+        ttl = self.ttl_for(url)
+        return {
+            "response": response,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": now,
+            "expires_at": now + ttl if ttl is not None else None,
+            "size": size,
+            "body": body,
+        }
+
+    @staticmethod
+    def is_fresh(entry: dict) -> bool:
+        return entry["expires_at"] is None or entry["expires_at"] > time.time()
+
+    def get(self, key: str):
+        entry = self._get(key)
+        if entry is not None and self.is_fresh(entry):
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, entry: dict) -> None:
+        raise NotImplementedError
+
+    def purge(self, expired_only: bool = False, pattern: str = None) -> int:
+        raise NotImplementedError
+
+
+class MemoryCache(ResponseCache):
+    """
+    Process-local LRU cache, lives as long as the client. Never expires by
+    default. Bounded by entry count and/or bytes; the least recently used
+    entries are evicted first. Entries are kept as raw JSON bytes and decoded
+    on every hit, so max_bytes bounds the memory actually held, and callers
+    (e.g. Annotation objects) never share response objects with the cache.
+    :param exclude: url path patterns that are never stored, e.g. ["*/content"]
+    """
+
+    def __init__(
+        self,
+        ttls: list = None,
+        max_entries: int = None,
+        max_bytes: int = None,
+        exclude: list = None,
+    ) -> None:
+        super().__init__(ttls)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.exclude = exclude or []
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def _get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        # An empty body (e.g. a 201 without content) is a None response
+        body = entry["body"]
+        return dict(entry, response=json_backend.loads(body) if body else None)
+
+    def set(self, key: str, entry: dict) -> None:
+        path = urlsplit(key.split(" ")[1]).path
+        if any(fnmatch.fnmatch(path, pattern) for pattern in self.exclude):
+            return
+        body = entry.get("body")
+        if body is None:
+            body = json_backend.dumps(entry["response"]).encode()
+        entry = dict(entry, response=None, body=body, size=len(body))
+        if self.max_bytes is not None and entry["size"] > self.max_bytes:
+            return
+
+        self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry["size"]
+
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+    def purge(self, expired_only: bool = False, pattern: str = None) -> int:
+        keys = [
+            key
+            for key, entry in self._entries.items()
+            if (not expired_only or not self.is_fresh(entry))
+            and (pattern is None or fnmatch.fnmatch(key.split(" ")[1], pattern))
+        ]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hit_ratio, 3),
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(ResponseCache):
+    """Persistent cache in a single SQLite file, survives kernel restarts."""
+
+    def __init__(self, path: str, ttls: list = DEFAULT_TTLS) -> None:
+        super().__init__(ttls)
+        self.path = path
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                response TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL,
+                expires_at REAL
+            )
+            """
+        )
+
+    def _get(self, key: str):
+        row = self._connection.execute(
+            "SELECT response, etag, last_modified, stored_at, expires_at "
+            "FROM responses WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        response, etag, last_modified, stored_at, expires_at = row
+        return {
+            "response": json_backend.loads(response) if response else None,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": stored_at,
+            "expires_at": expires_at,
+            "size": len(response),
+        }
+
+    def set(self, key: str, entry: dict) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                key.split(" ")[1],
+                (
+                    entry["body"].decode()
+                    if entry.get("body") is not None
+                    else json_backend.dumps(entry["response"])
+                ),
+                entry["etag"],
+                entry["last_modified"],
+                entry["stored_at"],
+                entry["expires_at"],
+            ),
+        )
+
+    def purge(self, expired_only: bool = False, pattern: str = None) -> int:
+        query = "DELETE FROM responses WHERE 1 = 1"
+        params = []
+        if expired_only:
+            query += " AND expires_at IS NOT NULL AND expires_at <= ?"
+            params.append(time.time())
+        if pattern is not None:
+            query += " AND url GLOB ?"
+            params.append(pattern)
+        return self._connection.execute(query, params).rowcount
+
+    def stats(self) -> dict:
+        total, expired, size = self._connection.execute(
+            "SELECT COUNT(*), "
+            "SUM(expires_at IS NOT NULL AND expires_at <= ?), "
+            "SUM(LENGTH(response)) FROM responses",
+            (time.time(),),
+        ).fetchone()
+        return {
+            "entries": total,
+            "expired": expired or 0,
+            "bytes": size or 0,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def entries(self, pattern: str = None) -> list:
+        query = "SELECT url, LENGTH(response), stored_at, expires_at FROM responses"
+        params = []
+        if pattern is not None:
+            query += " WHERE url GLOB ?"
+            params.append(pattern)
+        return self._connection.execute(query + " ORDER BY url", params).fetchall()
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or purge a response cache")
+    parser.add_argument("path", help="SQLite cache file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Show entry count and size")
+    list_parser = commands.add_parser("list", help="List cached urls")
+    list_parser.add_argument("--pattern", help="URL glob, e.g. '*/queues/*'")
+    purge_parser = commands.add_parser("purge", help="Delete cached entries")
+    purge_parser.add_argument("--expired", action="store_true", help="Only expired")
+    purge_parser.add_argument("--pattern", help="URL glob, e.g. '*/content'")
+    args = parser.parse_args(argv)
+
+    cache = SQLiteCache(args.path)
+    if args.command == "stats":
+        for name, value in cache.stats().items():
+            print(f"{name}: {value}")
+    elif args.command == "list":
+        now = time.time()
+        for url, size, stored_at, expires_at in cache.entries(args.pattern):
+            state = "fresh" if expires_at is None or expires_at > now else "expired"
+            stored = time.strftime("%Y-%m-%d %H:%M", time.localtime(stored_at))
+            print(f"{stored}  {state:7}  {size:>10}  {url}")
+    elif args.command == "purge":
+        print(f"Deleted {cache.purge(args.expired, args.pattern)} entries")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
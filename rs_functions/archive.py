@@ -0,0 +1,376 @@
+"""
+Columnar archive of annotation collections.
+
+<archive>/manifest.json            tables, columns and per-chunk stats
+<archive>/chunk-00000/<table>.<column>.json.gz
+
+Every column of every chunk is its own gzipped JSON list, so loading reads
+only the requested columns, and chunks whose queues / created_at range /
+schema ids can't match a filter are skipped without opening them.
+
+Appended chunks may hold newer versions of annotations already archived,
+and list ids that were removed; loading only returns the latest version.
+"""
+
+import gzip
+import json
+import os
+import re
+import shutil
+import pandas as pd
+import rs_classes.annotation as annotation
+from rs_classes import json_backend
+
+MANIFEST = "manifest.json"
+CHUNK_NAME = re.compile(r"^chunk-(\d+)$")
+TABLES = {
+    "annotations": [
+        "annotation_id",
+        "queue",
+        "schema",
+        "status",
+        "created_at",
+        "modified_at",
+        "metadata",
+        "content",
+    ],
+    "datapoints": [
+        "annotation_id",
+        "schema_id",
+        "parent_path",
+        "value",
+        "page",
+        "x1",
+        "y1",
+        "x2",
+        "y2",
+    ],
+    "pages": ["annotation_id", "page_id", "page", "page_width", "page_height"],
+    "emails": ["annotation_id", "email_id", "email"],
+}
+
+
+def _read_manifest(path: str) -> dict:
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return {"version": 1, "tables": TABLES, "chunks": []}
+    with open(manifest_path) as file:
+        return json.load(file)
+
+
+def _write_manifest(path: str, manifest: dict) -> None:
+    tmp_path = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+
+
+def _table_rows(objs: list) -> dict:
+    """Flatten annotations into {table: {column: [values]}}."""
+    tables = {
+        name: {column: [] for column in columns} for name, columns in TABLES.items()
+    }
+
+    def add(table, *values):
+        for column, value in zip(TABLES[table], values):
+            tables[table][column].append(value)
+
+    for obj in objs:
+        metadata = obj.metadata
+        add(
+            "annotations",
+            obj.id,
+            obj.queue,
+            obj.schema,
+            metadata.get("status"),
+            metadata.get("created_at"),
+            metadata.get("modified_at"),
+            metadata,
+            obj.annotation_content,
+        )
+        for schema_id, nodes in obj.schema_index.items():
+            parent_path = "/".join(obj.schema_path(schema_id))
+            for node in nodes:
+                if "content" not in node:
+                    continue
+                content = node["content"]
+                position = content.get("position") or [None] * 4
+                add(
+                    "datapoints",
+                    obj.id,
+                    schema_id,
+                    parent_path,
+                    content.get("value"),
+                    content.get("page"),
+                    *position,
+                )
+        for page_id, number, width, height in obj.pages:
+            add("pages", obj.id, page_id, number, width, height)
+        for email in obj.related_emails:
+            add("emails", obj.id, email.get("id"), email)
+
+    return tables
+
+
+def _write_chunk(path: str, name: str, objs: list) -> dict:
+    chunk_dir = os.path.join(path, name)
+    # Chunk names are never reused, a directory by this name can only be
+    # debris of an interrupted save
+    shutil.rmtree(chunk_dir, ignore_errors=True)
+    os.makedirs(chunk_dir)
+    tables = _table_rows(objs)
+    for table, columns in tables.items():
+        for column, values in columns.items():
+            file_name = os.path.join(chunk_dir, f"{table}.{column}.json.gz")
+            # One encode call; json.dump streams millions of tiny writes
+            with gzip.open(file_name, "wt", compresslevel=6) as file:
+                file.write(json_backend.dumps(values))
+
+    created = [value for value in tables["annotations"]["created_at"] if value]
+    return {
+        "name": name,
+        "rows": {
+            table: len(columns["annotation_id"]) for table, columns in tables.items()
+        },
+        "queues": sorted(set(tables["annotations"]["queue"])),
+        "schema_ids": sorted(set(tables["datapoints"]["schema_id"])),
+        "created_from": min(created) if created else None,
+        "created_to": max(created) if created else None,
+    }
+
+
+def _chunk_dirs(path: str) -> list:
+    return [
+        name
+        for name in os.listdir(path)
+        if CHUNK_NAME.match(name) and os.path.isdir(os.path.join(path, name))
+    ]
+
+
+def _next_chunk_index(path: str, manifest: dict) -> int:
+    names = _chunk_dirs(path) + [chunk["name"] for chunk in manifest["chunks"]]
+    return max((int(CHUNK_NAME.match(name).group(1)) for name in names), default=-1) + 1
+
+
+def save_archive(
+    path: str,
+    annotations_collection: dict,
+    append: bool = False,
+    chunk_size: int = 5000,
+    removed: list = None,
+) -> None:
+    """
+    Write annotations, datapoints, pages and emails of a collection.
+    New chunks are written under fresh names and the manifest is swapped in
+    last, so an interrupted save leaves the previous archive intact.
+    :param append: add new chunks to an existing archive instead of replacing it,
+        annotations already in the archive are superseded by the new version
+    :param removed: annotation ids to drop from the archive (with append)
+    """
+    os.makedirs(path, exist_ok=True)
+    manifest = _read_manifest(path)
+    if not append:
+        manifest["chunks"] = []
+        manifest.pop("sync", None)
+        manifest["appended"] = False
+    elif manifest["chunks"]:
+        manifest["appended"] = True
+
+    objs = list(annotations_collection.values())
+    next_index = _next_chunk_index(path, manifest)
+    new_chunks = []
+    for start in range(0, len(objs), chunk_size):
+        name = f"chunk-{next_index:05d}"
+        new_chunks.append(_write_chunk(path, name, objs[start : start + chunk_size]))
+        next_index += 1
+
+    if removed:
+        if not new_chunks:
+            new_chunks.append(_write_chunk(path, f"chunk-{next_index:05d}", []))
+        new_chunks[-1]["removed"] = list(removed)
+
+    manifest["chunks"].extend(new_chunks)
+    _write_manifest(path, manifest)
+
+    # Only now drop replaced chunks (and debris of interrupted saves)
+    current = {chunk["name"] for chunk in manifest["chunks"]}
+    for name in _chunk_dirs(path):
+        if name not in current:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def get_sync_state(path: str):
+    return _read_manifest(path).get("sync")
+
+
+def set_sync_state(path: str, state: dict) -> None:
+    manifest = _read_manifest(path)
+    manifest["sync"] = state
+    _write_manifest(path, manifest)
+
+
+def _current_ids(path: str, manifest: dict):
+    """Per chunk, the annotation ids whose latest version lives in it."""
+    if not manifest.get("appended"):
+        return None
+    shadowed = set()
+    current = {}
+    for chunk in reversed(manifest["chunks"]):
+        ids = set()
+        if chunk["rows"]["annotations"]:
+            ids = set(_read_column(path, chunk["name"], "annotations", "annotation_id"))
+        current[chunk["name"]] = ids - shadowed
+        shadowed |= ids
+        shadowed |= set(chunk.get("removed", []))
+    return current
+
+
+def _chunk_matches(chunk, queues, date_from, date_to, schema_ids) -> bool:
+    if queues is not None and not set(chunk["queues"]) & set(queues):
+        return False
+    if (
+        date_from is not None
+        and chunk["created_to"]
+        and chunk["created_to"] < date_from
+    ):
+        return False
+    if (
+        date_to is not None
+        and chunk["created_from"]
+        and chunk["created_from"] >= date_to
+    ):
+        return False
+    if schema_ids is not None and not set(chunk["schema_ids"]) & set(schema_ids):
+        return False
+    return True
+
+
+def _read_column(path: str, chunk: str, table: str, column: str) -> list:
+    with gzip.open(
+        os.path.join(path, chunk, f"{table}.{column}.json.gz"), "rt"
+    ) as file:
+        return json_backend.loads(file.read())
+
+
+def _selected_ids(path, chunk, queues, date_from, date_to):
+    """Annotation ids of a chunk matching queue/date filters, None if no filter."""
+    if queues is None and date_from is None and date_to is None:
+        return None
+    ids = _read_column(path, chunk, "annotations", "annotation_id")
+    keep = [True] * len(ids)
+    if queues is not None:
+        queues = {str(queue) for queue in queues}
+        queue_column = _read_column(path, chunk, "annotations", "queue")
+        keep = [k and q in queues for k, q in zip(keep, queue_column)]
+    if date_from is not None or date_to is not None:
+        created = _read_column(path, chunk, "annotations", "created_at")
+        keep = [
+            k
+            and c is not None
+            and (date_from is None or c >= date_from)
+            and (date_to is None or c < date_to)
+            for k, c in zip(keep, created)
+        ]
+    return {annotation_id for annotation_id, k in zip(ids, keep) if k}
+
+
+def load_table(
+    path: str,
+    table: str,
+    columns: list = None,
+    queues: list = None,
+    date_from: str = None,
+    date_to: str = None,
+    schema_ids: list = None,
+) -> pd.DataFrame:
+    """
+    Load one table ("annotations", "datapoints", "pages", "emails").
+    Only `columns` (default all) are read. Filters: queue ids, created_at
+    range as ISO strings (date_from <= created_at < date_to) and, for
+    datapoints, schema ids.
+    """
+    manifest = _read_manifest(path)
+    table_columns = manifest["tables"][table]
+    columns = list(columns or table_columns)
+    read_columns = list(dict.fromkeys(["annotation_id"] + columns))
+    if table == "datapoints" and schema_ids is not None:
+        read_columns = list(dict.fromkeys(read_columns + ["schema_id"]))
+    queues = [str(queue) for queue in queues] if queues is not None else None
+    current = _current_ids(path, manifest)
+
+    frames = []
+    for chunk in manifest["chunks"]:
+        if not chunk["rows"].get(table):
+            continue
+        if not _chunk_matches(
+            chunk,
+            queues,
+            date_from,
+            date_to,
+            schema_ids if table == "datapoints" else None,
+        ):
+            continue
+        frame = pd.DataFrame(
+            {
+                column: _read_column(path, chunk["name"], table, column)
+                for column in read_columns
+            }
+        )
+        ids = _selected_ids(path, chunk["name"], queues, date_from, date_to)
+        if ids is not None:
+            frame = frame[frame["annotation_id"].isin(ids)]
+        if current is not None:
+            frame = frame[frame["annotation_id"].isin(current[chunk["name"]])]
+        if table == "datapoints" and schema_ids is not None:
+            frame = frame[frame["schema_id"].isin(schema_ids)]
+        frames.append(frame[columns])
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_annotations(
+    path: str, queues: list = None, date_from: str = None, date_to: str = None
+) -> dict:
+    """Rebuild {annotation_id: Annotation} with content, pages and emails."""
+    annotations = load_table(
+        path,
+        "annotations",
+        ["annotation_id", "metadata", "content"],
+        queues=queues,
+        date_from=date_from,
+        date_to=date_to,
+    )
+    annotations_collection = {}
+    for metadata, content in zip(annotations["metadata"], annotations["content"]):
+        obj = annotation.Annotation(metadata)
+        obj.annotation_content = content
+        annotations_collection[obj.id] = obj
+
+    pages = load_table(
+        path, "pages", queues=queues, date_from=date_from, date_to=date_to
+    )
+    for annotation_id, page_id, number, width, height in pages.itertuples(index=False):
+        if annotation_id in annotations_collection:
+            annotations_collection[annotation_id].page_data = [
+                {"id": page_id, "number": number, "width": width, "height": height}
+            ]
+
+    emails = load_table(
+        path, "emails", ["annotation_id", "email"], queues, date_from, date_to
+    )
+    for annotation_id, email in emails.itertuples(index=False):
+        if annotation_id in annotations_collection:
+            annotations_collection[annotation_id].related_emails = email
+
+    return annotations_collection
+
+
+def compact_archive(path: str, chunk_size: int = 5000) -> None:
+    """Rewrite an appended archive keeping only the latest annotation versions."""
+    sync_state = get_sync_state(path)
+    annotations_collection = load_annotations(path)
+    save_archive(path, annotations_collection, chunk_size=chunk_size)
+    if sync_state is not None:
+        set_sync_state(path, sync_state)
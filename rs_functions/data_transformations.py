@@ -1,3 +1,5 @@
+import itertools
+import numpy as np
 import pandas as pd
 from IPython.display import display
 from rs_classes import annotation as annotation
@@ -59,153 +61,110 @@ def create_annotation_ids_widgts() -> widgets:
     return yes_no_buttons, annotation_text_box
 
 
-def form_dataset_for_text_value_analysis(
-    obj: annotation.Annotation, key: str, field_id: str
-) -> pd.DataFrame:
-    temp_list = []
-
-    metadata = obj.metadata
-
+def field_values(obj: annotation.Annotation, field_id: str) -> list:
+    """
+    Return [(value, manual)] for a field of one annotation.
+    "meta.<key>" fields read the annotation metadata and are never manual.
+    A datapoint is manual when it has a value but no position.
+    Missing fields give [(None, None)] so the annotation still gets a row.
+    """
     if field_id.split(".")[0] == "meta":
-        temp_list.append(
-            {"IDs": key, field_id: metadata.get(field_id.split(".")[1], None)}
-        )
-        temp_df = pd.DataFrame(temp_list)
-        temp_df.set_index("IDs", inplace=True)
-        return temp_df
-    else:
-        datapoints = find_by_schema_id(obj.annotation_content, field_id)
-        if datapoints:
-            for datapoint in datapoints:
-                content_value = datapoint["content"]["value"]
-                position_check = (
-                    "  || => Manual"
-                    if not datapoint["content"].get("position", False)
-                    and content_value != ""
-                    else ""
-                )
-                temp_list.append(
-                    {"IDs": key, field_id: f"{content_value}{position_check}"}
-                )
-            temp_df = pd.DataFrame(temp_list)
-            temp_df.set_index("IDs", inplace=True)
-            return temp_df
-        # if no datapoints return empty df
-        return pd.DataFrame()
+        return [(obj.metadata.get(field_id.split(".")[1], None), None)]
+
+    values = []
+    for datapoint in obj.find_by_schema_id(field_id):
+        content = datapoint["content"]
+        value = content["value"]
+        values.append((value, not content.get("position", False) and value != ""))
+    return values or [(None, None)]
 
 
 def text_value_analysis(
     field_ids: list, annotations_collection: dict, base_url: str
 ) -> pd.DataFrame:
-    output = pd.DataFrame()
+    """
+    One row per annotation (more for multivalue fields: one per combination
+    of values, like an outer join on the annotation id), indexed by "IDs".
+    Columns: Address, one column per field and a boolean "<field>_manual"
+    column per content field.
+    """
+    content_fields = [f for f in field_ids if f.split(".")[0] != "meta"]
+    columns = (
+        ["IDs", "Address"] + field_ids + [f"{field}_manual" for field in content_fields]
+    )
+
+    records = []
     for key, obj in annotations_collection.items():
-        temp_merged_df = pd.DataFrame([{"IDs": key, "Address": f"{base_url}/{key}"}])
-        temp_merged_df.set_index("IDs", inplace=True)
-        for field_id in field_ids:
-            temp_merged_df = temp_merged_df.merge(
-                form_dataset_for_text_value_analysis(obj, key, field_id),
-                how="outer",
-                left_index=True,
-                right_index=True,
-            )
-        output = pd.concat([output, temp_merged_df])
+        per_field = [field_values(obj, field_id) for field_id in field_ids]
+        address = f"{base_url}/{key}"
+        for combination in itertools.product(*per_field):
+            values = [value for value, _ in combination]
+            manual = [
+                flag
+                for field_id, (_, flag) in zip(field_ids, combination)
+                if field_id.split(".")[0] != "meta"
+            ]
+            records.append([key, address] + values + manual)
+
+    output = pd.DataFrame.from_records(records, columns=columns)
+    for field in content_fields:
+        output[f"{field}_manual"] = output[f"{field}_manual"].astype("boolean")
 
-    return output
+    return output.set_index("IDs")
 
 
-def find_by_schema_id(content, schema_id: str):
+def position_analysis(annotations_collection, field_id, slicer_field_id):
     """
-    Return all datapoints matching a schema id.
-    :param content: annotation content tree
-    :param schema_id: f
-    :return: the list of datapoints matching the schema ID
+    One row per datapoint of `field_id` that sits on a page, with its bounding
+    box, page size, slicer value and box center in % of the page size.
+    Datapoints without a page (e.g. empty or typed-in fields) are skipped.
     """
-    accumulator = []
-    for node in content:
-        if node["schema_id"] == schema_id:
-            accumulator.append(node)
-        elif "children" in node:
-            accumulator.extend(find_by_schema_id(node["children"], schema_id))
-
-    return accumulator
-
-
-def get_positions(annotation, field_id):
-    position_data = []
-    field_id_data = find_by_schema_id(annotation.annotation_content, field_id)
-    if field_id_data != []:
-        for result in field_id_data:
-            content = result["content"]
-            position_data.append(
-                {
-                    "annotation_id": annotation.id,
-                    "field_id": field_id,
-                    "page": content.get("page", None),
-                    "x1": content["position"][0]
-                    if content.get("position", None)
-                    else None,
-                    "y1": content["position"][1]
-                    if content.get("position", None)
-                    else None,
-                    "x2": content["position"][2]
-                    if content.get("position", None)
-                    else None,
-                    "y2": content["position"][3]
-                    if content.get("position", None)
-                    else None,
-                    "status": "exists",
-                }
-            )
-    else:
-        position_data.append(
-            {
-                "annotation_id": annotation.id,
-                "field_id": field_id,
-                "page": None,
-                "x1": None,
-                "y1": None,
-                "x2": None,
-                "y2": None,
-                "status": "absent_in_schema",
-            }
-        )
-
-    return position_data
-
+    # (annotation_id, page number) -> (width, height)
+    page_sizes = {
+        (obj.id, number): (width, height)
+        for obj in annotations_collection.values()
+        for _, number, width, height in obj.pages
+    }
 
-def position_analysis(annotations_collection, field_id, slicer_field_id):
-    output = pd.DataFrame()
+    annotation_ids, pages, slicers, boxes, sizes = [], [], [], [], []
+    no_position = (np.nan, np.nan, np.nan, np.nan)
+    no_size = (np.nan, np.nan)
     for obj in annotations_collection.values():
-        df = pd.DataFrame()
-        pages_df = pd.DataFrame(obj.page_data)
-        positions = get_positions(obj, field_id)
-        slicer = find_by_schema_id(
-            obj.annotation_content, slicer_field_id
-        )  ##ugly hot fix for header only fields
-        if slicer:
-            slicer = slicer[0]
-            slicer_value = slicer.get("content", [])["value"]
-        else:
-            slicer_value = "EMPTY SLICER"
-        if positions[0].get("page", False):  # hot fix for header only fields
-            positions_df = pd.DataFrame(positions)
-            df = pd.merge(
-                positions_df[["annotation_id", "page", "x1", "y1", "x2", "y2"]],
-                pages_df[["page", "page_width", "page_height"]],
-                on="page",
-                how="left",
-            )
-
-        df["slicer"] = slicer_value
-        output = pd.concat([output, df])
-
-    # Convert coordinates to percentages
-    # Calculate center of bounding box
-    output["center_x"] = (output["x1"] + output["x2"]) / 2
-    output["center_y"] = (output["y1"] + output["y2"]) / 2
-
-    # Convert coordinates to relative percentages
-    output["center_x_percent"] = output["center_x"] / output["page_width"] * 100
-    output["center_y_percent"] = output["center_y"] / output["page_height"] * 100
-
-    return output
+        slicer = obj.find_by_schema_id(slicer_field_id)
+        slicer_value = (
+            slicer[0].get("content", {}).get("value") if slicer else "EMPTY SLICER"
+        )
+        for datapoint in obj.find_by_schema_id(field_id):
+            content = datapoint.get("content", {})
+            page = content.get("page")
+            if page is None:
+                continue
+            annotation_ids.append(obj.id)
+            pages.append(page)
+            slicers.append(slicer_value)
+            boxes.append(content.get("position") or no_position)
+            sizes.append(page_sizes.get((obj.id, page), no_size))
+
+    coordinates = np.array(boxes, dtype=float).reshape(-1, 4)
+    page_dimensions = np.array(sizes, dtype=float).reshape(-1, 2)
+    center_x = (coordinates[:, 0] + coordinates[:, 2]) / 2
+    center_y = (coordinates[:, 1] + coordinates[:, 3]) / 2
+
+    return pd.DataFrame(
+        {
+            "annotation_id": annotation_ids,
+            "page": pages,
+            "x1": coordinates[:, 0],
+            "y1": coordinates[:, 1],
+            "x2": coordinates[:, 2],
+            "y2": coordinates[:, 3],
+            "page_width": page_dimensions[:, 0],
+            "page_height": page_dimensions[:, 1],
+            "slicer": slicers,
+            "center_x": center_x,
+            "center_y": center_y,
+            # Convert coordinates to relative percentages
+            "center_x_percent": center_x / page_dimensions[:, 0] * 100,
+            "center_y_percent": center_y / page_dimensions[:, 1] * 100,
+        }
+    )
@@ -1,25 +1,47 @@
 import rs_classes.async_request_client as async_client
+from rs_classes.checkpoint import CheckpointStore, run_checkpointed
 from rs_functions.gather_decorator import gather_throttled
-from rs_classes import annotation
+
 
 async def get_annotation_content(
     client: async_client.AsyncRequestClient,
     annotations_collection: dict,
+    concurrency: int = 100,
+    rate_limit=None,
+    missing_only: bool = False,
+    checkpoint: CheckpointStore = None,
+    job_id: str = None,
+    cache_on: bool = True,
 ) -> None:
-    # Create a list of coroutines for fetching annotation content
-    annotation_tasks = [
-        client._get_annotation_content(key) for key in annotations_collection.keys()
-    ]
+    """
+    Set annotation_content of every annotation in the collection.
+    :param cache_on: False to bypass the response cache and get current content
+    """
+    # Only fetch what wasn't sideloaded already
+    if missing_only:
+        annotations_collection = {
+            key: obj
+            for key, obj in annotations_collection.items()
+            if obj.annotation_content is None
+        }
 
-    # Home baked primitive throttling
-    annotation_contents = await gather_throttled(
-        tasks=annotation_tasks, sleep_limit=100, sleep_time=1
-    )
+    def restore(key, annotation_content):
+        annotations_collection[key].annotation_content = annotation_content
 
-    # Update annotation objects with fetched content
-    for key, annotation_content in zip(
-        annotations_collection.keys(), annotation_contents
-    ):
-        obj = annotations_collection[key]        
-        obj.annotation_content = annotation_content["content"]
+    async def fetch(keys, store):
+        # Keep `concurrency` requests in flight, store each response as it arrives
+        await gather_throttled(
+            tasks=[client._get_annotation_content(key, cache_on) for key in keys],
+            concurrency=concurrency,
+            rate_limit=rate_limit,
+            on_result=lambda i, response: store(keys[i], response["content"]),
+        )
 
+    await run_checkpointed(
+        checkpoint,
+        "content",
+        job_id,
+        list(annotations_collection.keys()),
+        restore,
+        fetch,
+    )
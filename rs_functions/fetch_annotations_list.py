@@ -1,31 +1,233 @@
 import rs_classes.async_request_client as async_client
-import rs_classes.annotation as annotation
-import json
+from rs_functions.gather_decorator import gather_throttled
+from rs_functions.sideload import annotations_from_response
 import asyncio
+import copy
+import datetime
+import json
+import logging
 
+logger = logging.getLogger(__name__)
 
-async def search_with_query(
-    client: async_client, query: json, allPages: bool = False, page_max=None
-) -> dict:
-    annotation_collection = {}
-    next, response = await client._search(params=query)
 
-    for result in response:
-        annotation_collection[result["id"]] = annotation.Annotation(result)
+async def search_with_query_stream(
+    client: async_client,
+    query: json,
+    allPages: bool = False,
+    page_max=None,
+    sideload: list = None,
+    content_schema_ids: list = None,
+    cache_on: bool = True,
+):
+    """
+    Yield a list of Annotation objects for every search page as it arrives.
+    :param sideload: e.g. ["content", "pages"] to get them in the same call
+    :param content_schema_ids: only sideload datapoints with these schema ids
+    :param cache_on: False to bypass the response cache, e.g. to see changes
+        made since an earlier identical search
+    """
+    response = await client._search_page(
+        params=query,
+        sideload=sideload,
+        content_schema_ids=content_schema_ids,
+        cache_on=cache_on,
+    )
+    yield annotations_from_response(response)
 
+    next = response["pagination"].get("next", False)
     page_count = 1
 
     if allPages:
         while next and (page_max is None or page_max + 1 > page_count):
-            if page_count % 10 == 0:
-                print("Sleeping - 2 seconds. ",page_count )
-                await asyncio.sleep(2)
-            if page_count % 100 == 0:
-                print("Sleeping - 5 seconds. ",page_count )
-                await asyncio.sleep(5)
-            next, response = await client._search(params=query, next_page=next)
-            for result in response:
-                annotation_collection[result["id"]] = annotation.Annotation(result)
+            response = await client._search_page(
+                params=query, next_page=next, cache_on=cache_on
+            )
+            yield annotations_from_response(response)
+            next = response["pagination"].get("next", False)
             page_count += 1
 
+
+async def search_with_query(
+    client: async_client,
+    query: json,
+    allPages: bool = False,
+    page_max=None,
+    date_from=None,
+    date_to=None,
+    partitions: int = None,
+    sideload: list = None,
+    content_schema_ids: list = None,
+) -> dict:
+    """
+    Run a search and return {annotation_id: Annotation}.
+    With `partitions` set (requires date_from), the query is split into
+    created_at windows that are searched concurrently, see search_partitioned.
+    Every window is read to the end, so this needs allPages=True and no
+    page_max.
+    """
+    if partitions:
+        if not allPages or page_max is not None:
+            raise ValueError(
+                "A partitioned search reads all pages, "
+                "use allPages=True without page_max"
+            )
+        return await search_partitioned(
+            client,
+            query,
+            date_from,
+            date_to,
+            partitions=partitions,
+            sideload=sideload,
+            content_schema_ids=content_schema_ids,
+        )
+
+    annotation_collection = {}
+    async for page in search_with_query_stream(
+        client, query, allPages, page_max, sideload, content_schema_ids
+    ):
+        for obj in page:
+            annotation_collection[obj.id] = obj
+
+    return annotation_collection
+
+
+def _to_datetime(value) -> datetime.datetime:
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+def window_query(query: json, field: str, start, end) -> json:
+    """Restrict a search query to start <= field < end."""
+    window = {field: {"$gte": start.isoformat(), "$lt": end.isoformat()}}
+    query = copy.deepcopy(query) if query else {}
+    if query.get("query"):
+        query["query"] = {"$and": [query["query"], window]}
+    else:
+        query["query"] = window
+    return query
+
+
+async def _search_window(
+    client: async_client,
+    query: json,
+    field: str,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    max_window_size: int,
+    min_window: datetime.timedelta,
+    sideload: list = None,
+    content_schema_ids: list = None,
+) -> dict:
+    params = window_query(query, field, start, end)
+    # Count with a one result page, a window that gets split never loads its
+    # own results (or their sideloads)
+    probe = await client._search_page(params=params, page_size=1)
+    total = probe["pagination"].get("total")
+    if total == 0:
+        return {}
+
+    # Too many results for one serial crawl: split the window in two
+    if total is not None and total > max_window_size and end - start > min_window:
+        middle = start + (end - start) / 2
+        logger.info("Splitting %s - %s, %s annotations", start, end, total)
+        left, right = await asyncio.gather(
+            _search_window(
+                client,
+                query,
+                field,
+                start,
+                middle,
+                max_window_size,
+                min_window,
+                sideload,
+                content_schema_ids,
+            ),
+            _search_window(
+                client,
+                query,
+                field,
+                middle,
+                end,
+                max_window_size,
+                min_window,
+                sideload,
+                content_schema_ids,
+            ),
+        )
+        left.update(right)
+        return left
+
+    response = await client._search_page(
+        params=params, sideload=sideload, content_schema_ids=content_schema_ids
+    )
+    annotation_collection = {}
+    for obj in annotations_from_response(response):
+        annotation_collection[obj.id] = obj
+
+    next = response["pagination"].get("next", False)
+    while next:
+        response = await client._search_page(params=params, next_page=next)
+        for obj in annotations_from_response(response):
+            annotation_collection[obj.id] = obj
+        next = response["pagination"].get("next", False)
+
+    return annotation_collection
+
+
+async def search_partitioned(
+    client: async_client,
+    query: json,
+    date_from,
+    date_to=None,
+    partitions: int = 8,
+    field: str = "created_at",
+    max_window_size: int = 2000,
+    min_window: datetime.timedelta = datetime.timedelta(minutes=1),
+    sideload: list = None,
+    content_schema_ids: list = None,
+) -> dict:
+    """
+    Split [date_from, date_to) into `partitions` disjoint windows on `field`
+    and search them concurrently. Windows reporting more than
+    `max_window_size` results are halved until they fit or reach `min_window`.
+    :param date_from: datetime or ISO string, start of the range
+    :param date_to: datetime or ISO string, defaults to now
+    :return: {annotation_id: Annotation} merged over all windows
+    """
+    if date_from is None:
+        raise ValueError("date_from is required for a partitioned search")
+    start = _to_datetime(date_from)
+    if date_to is None:
+        end = datetime.datetime.now(datetime.timezone.utc)
+        if start.tzinfo is None:
+            end = end.replace(tzinfo=None)
+    else:
+        end = _to_datetime(date_to)
+    if start >= end:
+        raise ValueError("date_from must be earlier than date_to")
+
+    step = (end - start) / partitions
+    bounds = [start + step * i for i in range(partitions)] + [end]
+    window_tasks = [
+        _search_window(
+            client,
+            query,
+            field,
+            bounds[i],
+            bounds[i + 1],
+            max_window_size,
+            min_window,
+            sideload,
+            content_schema_ids,
+        )
+        for i in range(partitions)
+    ]
+    windows = await gather_throttled(tasks=window_tasks, concurrency=partitions)
+
+    # Windows are disjoint, merging by id also drops any duplicates
+    annotation_collection = {}
+    for window in windows:
+        annotation_collection.update(window)
+
     return annotation_collection
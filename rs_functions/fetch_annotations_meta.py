@@ -1,32 +1,80 @@
+import logging
 import rs_classes.async_request_client as async_client
-import rs_classes.annotation as annotation
-import asyncio
+from rs_functions.gather_decorator import gather_throttled
+from rs_functions.sideload import annotations_from_response
+
+logger = logging.getLogger(__name__)
+
+
+async def _get_chunk_meta(
+    client: async_client.AsyncRequestClient,
+    ids: str,
+    sideload: list = None,
+    content_schema_ids: list = None,
+    cache_on: bool = True,
+) -> list:
+    response = await client._get_annotations_meta_page(
+        ids,
+        sideload=sideload,
+        content_schema_ids=content_schema_ids,
+        cache_on=cache_on,
+    )
+    objs = annotations_from_response(response)
+
+    next = response["pagination"].get("next", False)
+    while next:
+        response = await client._get_annotations_meta_page(
+            ids, next_page=next, cache_on=cache_on
+        )
+        objs.extend(annotations_from_response(response))
+        next = response["pagination"].get("next", False)
+
+    return objs
 
 
 async def get_annotation_meta(
     client: async_client.AsyncRequestClient,
-    annotation_list: dict,
+    annotation_list: list,
+    sideload: list = None,
+    content_schema_ids: list = None,
+    chunk_size: int = 100,
+    concurrency: int = 10,
+    cache_on: bool = True,
 ) -> dict:
-    ids = ",".join(annotation_list)
+    """
+    Load annotations by id. Ids are split into chunks of `chunk_size` to keep
+    URLs short, and chunks are fetched concurrently. Ids the API didn't
+    return (deleted, no access, typos) are reported.
+    :param cache_on: False to bypass the response cache and get current metadata
+    """
+    # Deduplicate, keep the order ids were given in
+    requested = list(
+        dict.fromkeys(str(annotation_id) for annotation_id in annotation_list)
+    )
+    chunk_tasks = [
+        _get_chunk_meta(
+            client,
+            ",".join(requested[start : start + chunk_size]),
+            sideload,
+            content_schema_ids,
+            cache_on,
+        )
+        for start in range(0, len(requested), chunk_size)
+    ]
+    chunks = await gather_throttled(tasks=chunk_tasks, concurrency=concurrency)
 
     annotation_collection = {}
-    next, response = await client._get_annotations_meta(ids)
-
-    for result in response:
-        annotation_collection[result["id"]] = annotation.Annotation(result)
+    for objs in chunks:
+        for obj in objs:
+            annotation_collection[obj.id] = obj
 
-    page_count = 1
-
-    while next:
-        if page_count % 10 == 0:
-            print("Sleeping - 2 seconds. ", page_count)
-            await asyncio.sleep(2)
-        if page_count % 100 == 0:
-            print("Sleeping - 5 seconds. ", page_count)
-            await asyncio.sleep(5)
-        next, response = await client._get_annotations_meta(ids, next_page=next)
-        for result in response:
-            annotation_collection[result["id"]] = annotation.Annotation(result)
-        page_count += 1
+    found = {str(annotation_id) for annotation_id in annotation_collection}
+    missing = [
+        annotation_id for annotation_id in requested if annotation_id not in found
+    ]
+    if missing:
+        logger.warning(
+            "%d annotation ids not found: %s", len(missing), ", ".join(missing[:20])
+        )
 
     return annotation_collection
@@ -5,24 +5,38 @@ from rs_functions.gather_decorator import gather_throttled
 async def get_email_content(
     client: async_client.AsyncRequestClient,
     annotations_collection: dict,
-) -> None:
-    # Create a list of coroutines for fetching annotation content
-    annotation_tasks = {} 
-    for annotation in annotations_collection.values():          
-        for email_id in annotation.related_email_ids:
-            task = client._get_email(email_id)
-            annotation_tasks[(annotation,email_id)] = task
+    concurrency: int = 100,
+    rate_limit=None,
+    cache_on: bool = True,
+) -> dict:
+    """
+    Set related_emails of every annotation, each email is fetched once.
+    :param cache_on: False to bypass the response cache and get current emails
+    """
+    # Email id -> annotations referencing it, so each email is fetched once
+    email_index = {}
+    for annotation in annotations_collection.values():
+        for email_id in annotation.related_email_ids or []:
+            if email_id is not None:
+                email_index.setdefault(email_id, {})[annotation.id] = annotation
 
+    email_ids = list(email_index.keys())
+    email_tasks = [client._get_email(email_id, cache_on) for email_id in email_ids]
 
-    # Home baked primitive throttling
-    annotation_related_emails = await gather_throttled(
-        tasks=annotation_tasks.values(), sleep_limit=100, sleep_time=1
+    # Attach every email to its annotations as it arrives
+    emails = {}
+
+    def store(i, email_content):
+        emails[email_ids[i]] = email_content
+        for annotation in email_index[email_ids[i]].values():
+            annotation.related_emails = email_content
+
+    # Keep `concurrency` requests in flight
+    await gather_throttled(
+        tasks=email_tasks,
+        concurrency=concurrency,
+        rate_limit=rate_limit,
+        on_result=store,
     )
 
-    for (annotation, email_id) in annotation_tasks.keys():
-        for email_content in annotation_related_emails:            
-            if int(email_content["id"]) == int(email_id):
-                annotation.related_emails = email_content
-            
-    
-    
\ No newline at end of file
+    return emails
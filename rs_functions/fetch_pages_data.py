@@ -1,32 +1,134 @@
 import rs_classes.async_request_client as async_client
+from rs_classes.checkpoint import CheckpointStore, run_checkpointed
 from rs_functions.gather_decorator import gather_throttled
+from rs_functions.sideload import _annotation_id
 
 
-async def pages_data(client: async_client.AsyncRequestClient, annotation_id) -> list:
+async def pages_data(
+    client: async_client.AsyncRequestClient, annotation_id, cache_on: bool = True
+) -> list:
     # get all pages data:
     pages_data = []
-    next, response = await client._get_pages(annotation_id)
+    next, response = await client._get_pages(annotation_id, cache_on=cache_on)
     pages_data.extend(response)
 
     while next:
-        next, response = await client._get_pages(annotation_id, next_page=next)
+        next, response = await client._get_pages(
+            annotation_id, next_page=next, cache_on=cache_on
+        )
         pages_data.extend(response)
     return pages_data
 
 
+async def pages_data_batch(
+    client: async_client.AsyncRequestClient,
+    annotation_ids: list,
+    concurrency: int = 10,
+    cache_on: bool = True,
+) -> dict:
+    """
+    Pages of many annotations with one listing, {annotation_id: [pages]}.
+    When the listing reports total_pages, the remaining pages are fetched
+    concurrently instead of following "next" links one by one.
+    """
+    ids = ",".join(str(annotation_id) for annotation_id in annotation_ids)
+    response = await client._get_pages_listing(ids, cache_on=cache_on)
+    results = list(response["results"])
+    pagination = response["pagination"]
+
+    total_pages = pagination.get("total_pages")
+    if total_pages and total_pages > 1:
+        rest = await gather_throttled(
+            tasks=[
+                client._get_pages_listing(
+                    ids, page_number=page_number, cache_on=cache_on
+                )
+                for page_number in range(2, total_pages + 1)
+            ],
+            concurrency=concurrency,
+        )
+        for listing in rest:
+            results.extend(listing["results"])
+    else:
+        next = pagination.get("next", False)
+        while next:
+            response = await client._get_pages_listing(
+                ids, next_page=next, cache_on=cache_on
+            )
+            results.extend(response["results"])
+            next = response["pagination"].get("next", False)
+
+    # Fan the pages back out to their annotations
+    pages = {annotation_id: [] for annotation_id in annotation_ids}
+    keys = {int(annotation_id): annotation_id for annotation_id in annotation_ids}
+    for page in results:
+        key = keys.get(_annotation_id(page.get("annotation")))
+        if key is not None:
+            pages[key].append(page)
+    for annotation_pages in pages.values():
+        annotation_pages.sort(key=lambda page: page["number"])
+    return pages
+
+
 async def get_annotations_page(
-    client: async_client.AsyncRequestClient, annotations_collection: dict
+    client: async_client.AsyncRequestClient,
+    annotations_collection: dict,
+    concurrency: int = 100,
+    rate_limit=None,
+    missing_only: bool = False,
+    checkpoint: CheckpointStore = None,
+    job_id: str = None,
+    batch_size: int = None,
+    cache_on: bool = True,
 ) -> None:
-    # now creating a list of new coroutines to get page data
-    pages_tasks = [pages_data(client, key) for key in annotations_collection.keys()]
+    """
+    Set page_data of every annotation in the collection.
+    :param batch_size: list pages of this many annotations per request
+        instead of one request (chain) per annotation
+    :param cache_on: False to bypass the response cache and get current pages
+    """
+    # Only fetch what wasn't sideloaded already
+    if missing_only:
+        annotations_collection = {
+            key: obj for key, obj in annotations_collection.items() if not obj.pages
+        }
 
-    # Home baked primitive throttling
-    annotation_pages = await gather_throttled(
-        tasks=pages_tasks, sleep_limit=100, sleep_time=1
-    )
+    def restore(key, annotation_page):
+        annotations_collection[key].page_data = annotation_page
 
-    # Update annotation objects with fetched pages
-    for key, annotation_page in zip(annotations_collection.keys(), annotation_pages):
-        obj = annotations_collection[key]
-        obj.page_data = annotation_page
+    async def fetch(keys, store):
+        if batch_size:
+            batches = [
+                keys[i : i + batch_size] for i in range(0, len(keys), batch_size)
+            ]
+            pages_tasks = [
+                pages_data_batch(client, batch, cache_on=cache_on) for batch in batches
+            ]
 
+            def on_result(i, batch_pages):
+                for key in batches[i]:
+                    store(key, batch_pages[key])
+
+        else:
+            # now creating a list of new coroutines to get page data
+            pages_tasks = [pages_data(client, key, cache_on) for key in keys]
+
+            def on_result(i, annotation_page):
+                store(keys[i], annotation_page)
+
+        # Keep `concurrency` requests in flight
+        await gather_throttled(
+            tasks=pages_tasks,
+            concurrency=concurrency,
+            rate_limit=rate_limit,
+            on_result=on_result,
+        )
+
+    await run_checkpointed(
+        checkpoint,
+        "pages",
+        job_id,
+        list(annotations_collection.keys()),
+        restore,
+        fetch,
+    )
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import rs_classes.async_request_client as async_client
+from rs_classes.checkpoint import CheckpointStore, job_key
+from rs_classes.profiler import StageProfiler, run_stage
+from rs_functions.fetch_annotations_list import search_with_query_stream
+from rs_functions.fetch_annotation_content import get_annotation_content
+from rs_functions.fetch_pages_data import get_annotations_page
+from rs_functions.fetch_emails import get_email_content
+
+
+async def fetch_batch(
+    client: async_client.AsyncRequestClient,
+    batch: dict,
+    content: bool = True,
+    pages: bool = False,
+    emails: bool = False,
+    checkpoint: CheckpointStore = None,
+    job_id: str = None,
+    profiler: StageProfiler = None,
+    cache_on: bool = True,
+) -> dict:
+    """
+    Fetch the requested extra data for one batch of annotations concurrently.
+    Content and pages already sideloaded by the search are not fetched again.
+    """
+    fetches = []
+    if content:
+        fetches.append(
+            run_stage(
+                profiler,
+                "content fetch",
+                get_annotation_content(
+                    client,
+                    batch,
+                    missing_only=True,
+                    checkpoint=checkpoint,
+                    job_id=f"{job_id}:content",
+                    cache_on=cache_on,
+                ),
+            )
+        )
+    if pages:
+        fetches.append(
+            run_stage(
+                profiler,
+                "pages fetch",
+                get_annotations_page(
+                    client,
+                    batch,
+                    missing_only=True,
+                    checkpoint=checkpoint,
+                    job_id=f"{job_id}:pages",
+                    batch_size=100,
+                    cache_on=cache_on,
+                ),
+            )
+        )
+    if emails:
+        fetches.append(
+            run_stage(
+                profiler,
+                "email fetch",
+                get_email_content(client, batch, cache_on=cache_on),
+            )
+        )
+    await asyncio.gather(*fetches)
+    return batch
+
+
+async def stream_annotations(
+    client: async_client.AsyncRequestClient,
+    query: json,
+    allPages: bool = False,
+    page_max=None,
+    content: bool = True,
+    pages: bool = False,
+    emails: bool = False,
+    max_pending: int = 4,
+    sideload: bool = False,
+    content_schema_ids: list = None,
+    checkpoint: CheckpointStore = None,
+    job_id: str = None,
+    profiler: StageProfiler = None,
+    cache_on: bool = True,
+):
+    """
+    Yield {annotation_id: Annotation} batches, one per search page, with
+    content/pages/emails already fetched. Fetching for a page starts while
+    the next search page is loading. At most `max_pending` batches are
+    fetched at once; when that many are in flight the search waits.
+    Batches are yielded in completion order.
+    :param sideload: ask the search to return content/pages in the same call,
+        per-id requests are then only made for annotations missing them
+    :param content_schema_ids: limit sideloaded content to these schema ids
+    :param checkpoint: store fetched content/pages as they arrive; re-running
+        the same query (or job_id) after an interruption skips what is
+        already stored. The job is cleared once every batch is fetched, so a
+        later run of the same query fetches fresh data
+    :param profiler: profile the search and every fetch as pipeline stages
+    :param cache_on: False to bypass the response cache for the search and
+        every fetch, so changed annotations come back with current data
+    """
+    if checkpoint is not None and job_id is None:
+        job_id = job_key("search", query, allPages, page_max)
+
+    sideloads = []
+    if sideload and content:
+        sideloads.append("content")
+    if sideload and pages:
+        sideloads.append("pages")
+
+    search = search_with_query_stream(
+        client, query, allPages, page_max, sideloads, content_schema_ids, cache_on
+    )
+    if profiler is not None:
+        search = profiler.iterate("search", search)
+
+    pending = set()
+    try:
+        async for page in search:
+            batch = {obj.id: obj for obj in page}
+            pending.add(
+                asyncio.ensure_future(
+                    fetch_batch(
+                        client,
+                        batch,
+                        content,
+                        pages,
+                        emails,
+                        checkpoint,
+                        job_id,
+                        profiler,
+                        cache_on,
+                    )
+                )
+            )
+
+            if len(pending) >= max_pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+            else:
+                done = {task for task in pending if task.done()}
+                pending -= done
+            for task in done:
+                yield task.result()
+
+        for task in asyncio.as_completed(pending):
+            yield await task
+        pending = set()
+
+        # Finished, nothing left to resume
+        if checkpoint is not None:
+            checkpoint.clear(f"{job_id}:content")
+            checkpoint.clear(f"{job_id}:pages")
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def search_and_fetch(
+    client: async_client.AsyncRequestClient,
+    query: json,
+    allPages: bool = False,
+    page_max=None,
+    content: bool = True,
+    pages: bool = False,
+    emails: bool = False,
+    sideload: bool = False,
+    content_schema_ids: list = None,
+    checkpoint: CheckpointStore = None,
+    job_id: str = None,
+    profiler: StageProfiler = None,
+    cache_on: bool = True,
+) -> dict:
+    """Pipelined replacement for search_with_query followed by the fetch_* calls."""
+    annotations_collection = {}
+    async for batch in stream_annotations(
+        client,
+        query,
+        allPages,
+        page_max,
+        content,
+        pages,
+        emails,
+        sideload=sideload,
+        content_schema_ids=content_schema_ids,
+        checkpoint=checkpoint,
+        job_id=job_id,
+        profiler=profiler,
+        cache_on=cache_on,
+    ):
+        annotations_collection.update(batch)
+
+    return annotations_collection
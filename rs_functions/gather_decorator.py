@@ -1,22 +1,46 @@
 import asyncio
-from asyncio import gather
+from rs_classes.rate_limiter import TokenBucket
 
 
-async def gather_throttled(tasks: list, sleep_limit: int, sleep_time: int) -> dict:
-    annotation_contents = []
-    task_accumulator = []
+async def gather_throttled(
+    tasks: list, concurrency: int = 100, rate_limit=None, on_result=None
+) -> list:
+    """
+    Await coroutines keeping at most `concurrency` of them in flight.
+    A new one starts as soon as any running one finishes, so a slow request
+    only holds its own slot.
+    :param tasks: coroutines to run
+    :param concurrency: max number of coroutines awaited at the same time
+    :param rate_limit: optional requests per second cap (number or TokenBucket)
+    :param on_result: optional callback(index, result) called as each one finishes
+    :return: results in the same order as tasks
+    """
+    tasks = list(tasks)
+    results = [None] * len(tasks)
+    pending = iter(enumerate(tasks))
 
-    for i, arg in enumerate(tasks):
-        task_accumulator.append(arg)
-        if i % sleep_limit == 0 and i != 0:
-            print("Sleeping")
-            await asyncio.sleep(sleep_time)
-            task_bucket = task_accumulator.copy()
-            annotation_contents.extend(await asyncio.gather(*task_bucket))
-            task_accumulator.clear()
+    if rate_limit is not None and not isinstance(rate_limit, TokenBucket):
+        rate_limit = TokenBucket(rate_limit)
 
-    # Gather remaining tasks if task_bucket is not empty
-    if task_accumulator:
-        annotation_contents.extend(await asyncio.gather(*task_accumulator))
+    async def worker():
+        for i, task in pending:
+            if rate_limit is not None:
+                await rate_limit.acquire()
+            results[i] = await task
+            if on_result is not None:
+                on_result(i, results[i])
 
-    return annotation_contents
+    workers = [
+        asyncio.ensure_future(worker()) for _ in range(min(concurrency, len(tasks)))
+    ]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for w in workers:
+            w.cancel()
+        # Close coroutines that never started to avoid "never awaited" warnings
+        for _, task in pending:
+            task.close()
+        raise
+
+    return results
@@ -0,0 +1,74 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import LocalOutlierFactor
+
+
+POSITION_COLUMNS = ["center_x_percent", "center_y_percent"]
+
+
+def _fit_slicer(job: tuple) -> tuple:
+    # Runs in a worker process, so it only gets and returns plain arrays
+    group, points, n_neighbors, contamination = job
+    lof = LocalOutlierFactor(n_neighbors=n_neighbors, contamination=contamination)
+    labels = lof.fit_predict(points)
+    return group, labels, -lof.negative_outlier_factor_
+
+
+def _collect(results, groups: list, labels: np.ndarray, scores: np.ndarray) -> None:
+    for group, group_labels, group_scores in results:
+        rows = groups[group]
+        labels[rows] = group_labels
+        scores[rows] = group_scores
+
+
+def detect_position_outliers(
+    df: pd.DataFrame,
+    n_neighbors: int = 2,
+    contamination="auto",
+    max_workers: int = None,
+    columns: list = POSITION_COLUMNS,
+) -> tuple:
+    """
+    Fit a LocalOutlierFactor per slicer value on the output of
+    position_analysis. The frame is grouped once and the per-slicer models
+    are fitted in a process pool. Slicers with n_neighbors rows or fewer
+    are not fitted.
+    :param max_workers: pool size, 1 fits everything in this process
+    :return: (df with "outlier" and "lof_score" columns,
+              per-slicer summary with rows, outliers, max_score, mean_score)
+    """
+    df = df.dropna(subset=columns).reset_index(drop=True)
+    # Row positions per slicer; jobs refer to groups by position because
+    # slicer values (e.g. NaN) don't always survive pickling as dict keys
+    groups = list(df.groupby("slicer", sort=False, dropna=False).indices.values())
+    points = df[columns].to_numpy(dtype=float)
+
+    jobs = [
+        (group, points[rows], n_neighbors, contamination)
+        for group, rows in enumerate(groups)
+        if len(rows) > n_neighbors
+    ]
+
+    labels = np.ones(len(df), dtype=int)
+    scores = np.full(len(df), np.nan)
+
+    if max_workers == 1 or len(jobs) < 2:
+        results = map(_fit_slicer, jobs)
+        _collect(results, groups, labels, scores)
+    else:
+        workers = max_workers or os.cpu_count() or 1
+        chunksize = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_fit_slicer, jobs, chunksize=chunksize)
+            _collect(results, groups, labels, scores)
+
+    labelled = df.assign(outlier=labels == -1, lof_score=scores)
+    summary = labelled.groupby("slicer", sort=False, dropna=False).agg(
+        rows=("outlier", "size"),
+        outliers=("outlier", "sum"),
+        max_score=("lof_score", "max"),
+        mean_score=("lof_score", "mean"),
+    )
+    return labelled, summary.sort_values("max_score", ascending=False)
@@ -0,0 +1,59 @@
+import re
+import rs_classes.annotation as annotation
+
+ANNOTATION_ID = re.compile(r"/annotations/(\d+)")
+
+
+def _annotation_id(url):
+    match = ANNOTATION_ID.search(url or "")
+    return int(match.group(1)) if match else None
+
+
+def _content_trees(datapoints: list) -> dict:
+    """
+    Group sideloaded datapoints into {annotation_id: content tree}.
+    Children given as urls are replaced with the sideloaded datapoints;
+    nodes that are nobody's child become the roots of the tree.
+    """
+    by_url = {node["url"]: node for node in datapoints if "url" in node}
+    child_urls = set()
+    for node in datapoints:
+        children = node.get("children")
+        if children and isinstance(children[0], str):
+            node["children"] = [by_url[url] for url in children if url in by_url]
+            child_urls.update(children)
+
+    trees = {}
+    for node in datapoints:
+        if node.get("url") in child_urls:
+            continue
+        annotation_id = _annotation_id(node.get("url"))
+        if annotation_id is not None:
+            trees.setdefault(annotation_id, []).append(node)
+    return trees
+
+
+def annotations_from_response(response: dict) -> list:
+    """
+    Build Annotation objects from a listing/search response and attach any
+    sideloaded content and pages. Annotations without sideloaded data keep
+    annotation_content None / empty page_data, so callers can fall back to
+    per-id fetches for them.
+    """
+    objs = [annotation.Annotation(result) for result in response["results"]]
+
+    if response.get("content"):
+        trees = _content_trees(response["content"])
+        for obj in objs:
+            if obj.id in trees:
+                obj.annotation_content = trees[obj.id]
+
+    if response.get("pages"):
+        pages = {}
+        for page in response["pages"]:
+            pages.setdefault(_annotation_id(page.get("annotation")), []).append(page)
+        for obj in objs:
+            if obj.id in pages:
+                obj.page_data = sorted(pages[obj.id], key=lambda p: p["number"])
+
+    return objs
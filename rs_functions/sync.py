@@ -0,0 +1,117 @@
+import datetime
+import json
+import logging
+import rs_classes.async_request_client as async_client
+import rs_functions.archive as archive
+from rs_functions.fetch_annotations_meta import get_annotation_meta
+from rs_functions.fetch_pipeline import search_and_fetch
+
+logger = logging.getLogger(__name__)
+
+# Margin subtracted from the run start, covers the local clock running ahead
+# of the server's
+CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+
+def changed_since(query: json, watermark: str) -> json:
+    """Restrict a search query to annotations created or modified since watermark."""
+    changed = {
+        "$or": [
+            {"modified_at": {"$gte": watermark}},
+            {"created_at": {"$gte": watermark}},
+        ]
+    }
+    query = dict(query or {})
+    query["query"] = (
+        {"$and": [query["query"], changed]} if query.get("query") else changed
+    )
+    return query
+
+
+def _run_start() -> str:
+    """
+    Watermark for this run: when it started, before the search. Anything
+    modified during the pull has a later modified_at and is synced next time,
+    whichever search page it was on.
+    """
+    started = datetime.datetime.now(datetime.timezone.utc) - CLOCK_SKEW
+    return started.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _parse_time(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+async def sync_archive(
+    client: async_client.AsyncRequestClient,
+    path: str,
+    query: json,
+    content: bool = True,
+    pages: bool = False,
+    emails: bool = False,
+    sideload: bool = False,
+    content_schema_ids: list = None,
+) -> dict:
+    """
+    Keep an archive in sync with a search query.
+    The first run pulls everything and stores a watermark (when the run
+    started). Later runs only search annotations changed since the
+    watermark, fetch content/pages/emails for those, and append them to the
+    archive. The other archived annotations are looked up by id; those the
+    API no longer returns, or that changed without matching the query any
+    more (deleted, moved to another status...), are removed from the archive.
+    :return: the annotations fetched in this run
+    """
+    # The cache would hand back what an earlier run saw, not the change
+    fetch_options = dict(
+        cache_on=False,
+        content=content,
+        pages=pages,
+        emails=emails,
+        sideload=sideload,
+        content_schema_ids=content_schema_ids,
+    )
+    started = _run_start()
+    state = archive.get_sync_state(path)
+
+    # No watermark yet (also archives of an empty pull): full pull
+    if state is None or state["watermark"] is None:
+        annotations_collection = await search_and_fetch(
+            client, query, allPages=True, **fetch_options
+        )
+        archive.save_archive(path, annotations_collection)
+        archive.set_sync_state(path, {"query": query, "watermark": started})
+        logger.info("Archived %d annotations", len(annotations_collection))
+        return annotations_collection
+
+    if state["query"] != query:
+        raise ValueError("Archive was synced with another query, do a full pull")
+
+    watermark = state["watermark"]
+    updated = await search_and_fetch(
+        client, changed_since(query, watermark), allPages=True, **fetch_options
+    )
+
+    # Archived annotations the delta search didn't return: gone, or changed
+    # since the watermark and so no longer matching the query. Only archived
+    # ids are looked up, not every change in the organization
+    others = [
+        int(annotation_id)
+        for annotation_id in archive.load_table(path, "annotations", ["annotation_id"])[
+            "annotation_id"
+        ]
+        if annotation_id not in updated
+    ]
+    current = await get_annotation_meta(client, others, cache_on=False)
+    since = _parse_time(watermark)
+    removed = []
+    for annotation_id in others:
+        obj = current.get(annotation_id)
+        modified_at = obj.metadata.get("modified_at") if obj is not None else None
+        if obj is None or (modified_at and _parse_time(modified_at) >= since):
+            removed.append(annotation_id)
+
+    archive.save_archive(path, updated, append=True, removed=removed)
+    archive.set_sync_state(path, {"query": query, "watermark": started})
+    logger.info("Synced %d updated, %d removed annotations", len(updated), len(removed))
+    return updated
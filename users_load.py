@@ -1,3 +1,4 @@
+import aiohttp
 import rs_classes.async_request_client as rs
 import pandas as pd
 import datetime
@@ -24,8 +25,11 @@ SUPPORTED_COLUMNS = {
 
 
 async def main():
-    client = rs.AsyncRequestClient(token=TOKEN, domain=DOMAIN)
+    async with rs.AsyncRequestClient(token=TOKEN, domain=DOMAIN) as client:
+        await load_users(client)
 
+
+async def load_users(client: rs.AsyncRequestClient):
     logger = Logger()
 
     df = read_template(UPLOAD_FILE_PATH, UPLOAD_F_SHEET_NAME)
@@ -61,9 +65,15 @@ async def main():
 
             logger.add(f"User created - {response}", **user_data)
             print(f"User created - {response}")
-        except:
-            print(f"HTTP error- {response}")
-            logger.add(f"Error - user not created - {response}", **user_data)
+        except aiohttp.ClientResponseError as e:
+            print(f"HTTP error- {e.status} {e.message}")
+            logger.add(
+                f"Error - user not created - {e.status} {e.message}", **user_data
+            )
+            continue
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Request error - {e!r}")
+            logger.add(f"Error - user not created - {e!r}", **user_data)
             continue
 
         if user_data["auth_type"] == "password":
@@ -71,9 +81,15 @@ async def main():
                 response = await client.reset_password(user_data["email"])
                 logger.add(f"Password reset - {response}", **user_data)
                 print(f"Password reset is done - {response}")
-            except:
-                print(f"HTTP error - {response}")
-                logger.add(f"Error - password reset failed - {response}", **user_data)
+            except aiohttp.ClientResponseError as e:
+                print(f"HTTP error - {e.status} {e.message}")
+                logger.add(
+                    f"Error - password reset failed - {e.status} {e.message}",
+                    **user_data,
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Request error - {e!r}")
+                logger.add(f"Error - password reset failed - {e!r}", **user_data)
 
     log_path_list = UPLOAD_FILE_PATH.split("/")[:-1]
     if len(log_path_list) > 0: